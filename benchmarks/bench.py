@@ -0,0 +1,175 @@
+"""
+Offline end-to-end benchmark: runs notion_to_notion and the Anki import against the fake services
+over synthetic pages and reports throughput and per-stage latency percentiles.
+
+    python benchmarks/bench.py --blocks 10 100 1000 10000 --images 0 20 --repeat 3
+
+No network and no credentials are needed. The 2anki export drives a browser on a website, it is not
+an API that can be faked, so the import is benchmarked with the "direct" or "native" export.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import time
+import types
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_services import FakeServices, build_page
+
+SOURCE_PAGE = "11111111-1111-1111-1111-111111111111"
+DESTINATION_PAGE = "22222222-2222-2222-2222-222222222222"
+
+
+def import_sync():
+    # The benchmark never reaches a real service, dummy credentials are enough when there are none
+    if importlib.util.find_spec("credentials") is None:
+        sys.modules["credentials"] = types.SimpleNamespace(
+            OPENAI_API_KEY="sk-bench", NOTION_API_KEY="secret_bench", CLOUDINARY_CLOUD_NAME="bench",
+            CLOUDINARY_API_KEY="bench", CLOUDINARY_API_SECRET="bench"
+        )
+    from notion_to_anki import sync
+    return sync
+
+
+def point_to_fakes(services, notion_rate):
+    # Swap the clients of the backends for ones that talk to the fake services
+    import cloudinary
+    from notion_to_anki.anki_connect import AnkiConnect
+    from notion_to_anki.backends import anki, llm, notion
+    from notion_to_anki.notion_http import NotionClient
+
+    notion._client = NotionClient("secret_bench", f"{services.notion.url}/v1", rate=notion_rate, burst=notion_rate)
+    anki._client = AnkiConnect(services.anki.url)
+    llm.OPENAI_BASE_URL = f"{services.openai.url}/v1"
+    llm._openai_client = None
+    cloudinary.config(upload_prefix=services.cloudinary.url)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = (len(values) - 1) * q
+    low = int(index)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (index - low)
+
+
+def read_trace(path):
+    spans = defaultdict(list)
+    totals = {}
+    first_card = None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record["type"] == "span":
+                spans[record["name"]].append(record["duration"])
+                first_card = record["attributes"].get("first_card_seconds", first_card)
+            else:
+                totals = record["counters"]
+    return spans, totals, first_card
+
+
+def run_case(sync, blocks, images, args):
+    from notion_to_anki import tracing
+
+    results = []
+    stage_durations = defaultdict(list)
+    for repeat in range(args.repeat):
+        with tempfile.TemporaryDirectory() as work_dir, FakeServices(
+            {}, latency=args.latency, notion_rate_limit=args.notion_rate,
+            openai_seconds_per_token=args.seconds_per_token, notion_page_size=args.page_size
+        ) as services:
+            services.notion.add_page(SOURCE_PAGE, build_page(blocks, images, services.files.url, seed=repeat))
+            services.notion.add_page(DESTINATION_PAGE, {"page": []})
+            point_to_fakes(services, args.notion_rate or 1000)
+            cwd = os.getcwd()
+            os.chdir(work_dir)
+            try:
+                tracing.start_run(os.path.join(work_dir, "traces"))
+                started = time.perf_counter()
+                result = sync.notion_to_notion(SOURCE_PAGE, DESTINATION_PAGE, "es", full_sync=True,
+                                               use_llm_cache=False, llm_mode=args.llm_mode,
+                                               create_temp_page=False)
+                cards = 0
+                if result is not None:
+                    temp_page_url, formatted_content = result
+                    cards = len(formatted_content.anki)
+                    sync.import_to_anki(temp_page_url, formatted_content, "Bench", args.export)
+                elapsed = time.perf_counter() - started
+                spans, totals, first_card = read_trace(tracing.end_run())
+            finally:
+                os.chdir(cwd)
+            for name, durations in spans.items():
+                stage_durations[name].extend(durations)
+            results.append({"elapsed": elapsed, "cards": cards, "first_card": first_card,
+                            "notion_requests": services.notion.requests, "throttled": services.notion.throttled,
+                            "counters": totals})
+    elapsed = [result["elapsed"] for result in results]
+    return {
+        "blocks": blocks, "images": images, "repeat": args.repeat,
+        "elapsed_p50": percentile(elapsed, 0.5),
+        "blocks_per_second": blocks / percentile(elapsed, 0.5) if elapsed else 0,
+        "cards": results[-1]["cards"],
+        "first_card_p50": percentile([result["first_card"] for result in results if result["first_card"] is not None],
+                                     0.5),
+        "notion_requests": results[-1]["notion_requests"],
+        "throttled": results[-1]["throttled"],
+        "stages": {
+            name: {"count": len(durations), "p50": percentile(durations, 0.5), "p90": percentile(durations, 0.9),
+                   "p99": percentile(durations, 0.99), "total": sum(durations)}
+            for name, durations in sorted(stage_durations.items())
+        },
+    }
+
+
+def print_report(report):
+    print(f"\n== {report['blocks']} blocks, {report['images']} images: {report['elapsed_p50']:.2f}s "
+          f"({report['blocks_per_second']:.0f} blocks/s), {report['cards']} cards, "
+          f"{report['notion_requests']} Notion requests, {report['throttled']} throttled")
+    if report["first_card_p50"]:
+        print(f"   first card published after {report['first_card_p50']:.2f}s")
+    print(f"   {'stage':<28}{'calls':>7}{'p50':>10}{'p90':>10}{'p99':>10}")
+    for name, stage in report["stages"].items():
+        print(f"   {name:<28}{stage['count']:>7}{stage['p50']:>10.3f}{stage['p90']:>10.3f}{stage['p99']:>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--blocks", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--images", type=int, nargs="+", default=[0, 20])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every fake request")
+    parser.add_argument("--notion-rate", type=float, default=None,
+                        help="requests per second allowed by the fake Notion (default: unlimited)")
+    parser.add_argument("--seconds-per-token", type=float, default=0.0, help="generation speed of the fake LLM")
+    parser.add_argument("--page-size", type=int, default=100,
+                        help="blocks per page of the fake Notion children listing (the API allows at most 100)")
+    parser.add_argument("--export", choices=["direct", "native"], default="direct")
+    parser.add_argument("--llm-mode", choices=["sync", "async", "batch", "stream"], default="sync",
+                        help="stream publishes the cards to Notion while they are generated")
+    parser.add_argument("--json", help="write the reports to this file")
+    args = parser.parse_args()
+
+    sync = import_sync()
+    reports = []
+    for blocks in args.blocks:
+        for images in args.images:
+            if images > blocks:
+                continue
+            report = run_case(sync, blocks, images, args)
+            reports.append(report)
+            print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Cold start of the command line: for every subcommand, the time a fresh interpreter takes to import
+the modules the command runs with, and which heavy dependencies got loaded on the way.
+
+    python benchmarks/cold_start.py --repeat 5
+
+The heavy dependencies are only imported by the backend functions that use them, so none of them
+should show up here. The last line shows what importing all of them costs, which is what every
+invocation paid when main.py imported them at load time.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ["openai", "selenium", "cloudinary", "PIL", "psutil", "tiktoken", "credentials"]
+# What every subcommand imports before it starts working
+COMMAND_IMPORTS = {
+    "--help": ["notion_to_anki.cli"],
+    "fetch": ["notion_to_anki.cli", "notion_to_anki.sync"],
+    "format": ["notion_to_anki.cli", "notion_to_anki.sync"],
+    "publish": ["notion_to_anki.cli", "notion_to_anki.sync"],
+    "import": ["notion_to_anki.cli", "notion_to_anki.sync"],
+    "run": ["notion_to_anki.cli", "notion_to_anki.sync"],
+    "gc": ["notion_to_anki.cli", "notion_to_anki.cleanup"],
+    "all heavy dependencies": ["openai", "selenium.webdriver", "cloudinary.uploader", "PIL.Image", "psutil"],
+}
+
+PROBE = """
+import importlib, json, sys, time
+started = time.perf_counter()
+for name in {modules!r}:
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        pass
+elapsed = time.perf_counter() - started
+print(json.dumps({{"seconds": elapsed,
+                  "heavy": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def measure(modules, repeat):
+    samples = []
+    heavy = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE.format(modules=modules, heavy=HEAVY_MODULES)],
+            cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output)
+        samples.append(result["seconds"])
+        heavy = result["heavy"]
+    return statistics.median(samples), heavy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'command':<26}{'import (ms)':>12}   heavy modules loaded")
+    for command, modules in COMMAND_IMPORTS.items():
+        seconds, heavy = measure(modules, args.repeat)
+        print(f"{command:<26}{seconds * 1000:>12.1f}   {', '.join(heavy) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Deduplication of the generated cards: the time DuplicateFilter.keep takes over cards of one topic,
+and how many signatures it compares per card, for vocabularies from broad to a single narrow topic.
+
+    python benchmarks/dedup.py --cards 5000 --vocabulary 2000 200 20
+
+Cards of the same topic share most of their shingles and so most of their LSH buckets. A card is
+compared with every kept card it shares a bucket with, once, the ones sharing the most buckets first,
+until the first near duplicate. A fraction of the cards (--duplicates) are rewordings of an earlier
+card, the filter should drop about that many.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from notion_to_anki import card_index
+
+
+def topic_cards(count, vocabulary, duplicates, seed):
+    # Questions and answers drawn from the same words, some of them an earlier card with a word changed
+    rng = random.Random(seed)
+    words = [f"{rng.choice('bcdfglmnprst')}{rng.choice('aeiou')}{rng.choice('nrsl')}{index}"
+             for index in range(vocabulary)]
+    cards = []
+    for _ in range(count):
+        if cards and rng.random() < duplicates:
+            question, answer = rng.choice(cards)
+            answer = answer.split()
+            answer[rng.randrange(len(answer))] = rng.choice(words)
+            cards.append((question, " ".join(answer)))
+        else:
+            cards.append((f"¿Qué es {' '.join(rng.choices(words, k=rng.randint(2, 6)))}?",
+                          " ".join(rng.choices(words, k=rng.randint(10, 40)))))
+    return cards
+
+
+def run_case(cards):
+    comparisons = [0]
+    similarity = card_index.similarity
+
+    def counted(signature, other):
+        comparisons[0] += 1
+        return similarity(signature, other)
+
+    card_index.similarity = counted
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            index = card_index.CardIndex(os.path.join(directory, "card_index.sqlite"))
+            duplicate_filter = card_index.DuplicateFilter(index, "Benchmark")
+            started = time.perf_counter()
+            kept = sum(duplicate_filter.keep(question, answer) for question, answer in cards)
+            seconds = time.perf_counter() - started
+            index.close()
+    finally:
+        card_index.similarity = similarity
+    return seconds, kept, duplicate_filter.dropped, comparisons[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cards", type=int, default=5000)
+    parser.add_argument("--vocabulary", type=int, nargs="+", default=[2000, 200, 20],
+                        help="distinct words of the topic, fewer is a narrower topic")
+    parser.add_argument("--duplicates", type=float, default=0.2, help="fraction of the cards that reword another")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'vocabulary':>10}{'seconds':>10}{'ms/card':>10}{'kept':>8}{'dropped':>9}{'compared/card':>15}")
+    for vocabulary in args.vocabulary:
+        cards = topic_cards(args.cards, vocabulary, args.duplicates, args.seed)
+        seconds, kept, dropped, comparisons = run_case(cards)
+        print(f"{vocabulary:>10}{seconds:>10.2f}{seconds * 1000 / len(cards):>10.3f}{kept:>8}{dropped:>9}"
+              f"{comparisons / len(cards):>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,515 @@
+"""
+Local stand-ins for the services the pipeline talks to: Notion, the image host of the Notion files,
+Cloudinary, OpenAI (chat completions, files and batches) and AnkiConnect.
+Every service runs in its own thread on a free port, with configurable latency and rate limit.
+"""
+import json
+import random
+import re
+import struct
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def make_png(width, height, seed=0):
+    # A valid PNG with some noise, so it doesn't compress to nothing
+    rng = random.Random(seed)
+    rows = b"".join(b"\x00" + bytes(rng.getrandbits(8) for _ in range(width * 3)) for _ in range(height))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b"")
+
+
+def text_block(block_type, text, has_children=False, edited="2024-01-01T00:00:00.000Z"):
+    return {
+        "object": "block", "id": str(uuid.uuid4()), "type": block_type, "has_children": has_children,
+        "last_edited_time": edited,
+        block_type: {"rich_text": [{
+            "type": "text", "plain_text": text, "href": None, "text": {"content": text, "link": None},
+            "annotations": {"bold": False, "italic": False, "strikethrough": False, "underline": False,
+                            "code": False, "color": "default"}
+        }], "color": "default"}
+    }
+
+
+def build_page(blocks, images, files_url, section_size=20, nested_every=10, seed=0):
+    """
+    Synthetic lecture notes: a heading_2 every section_size blocks, paragraphs, bulleted items with a
+    nested child every nested_every blocks and images spread over the page.
+    Returns {parent id: [children]} with the page itself under "page".
+    """
+    rng = random.Random(seed)
+    words = ["matriz", "vector", "gradiente", "función", "derivada", "pila", "grafo", "árbol", "hash", "red"]
+    tree = {"page": []}
+    image_positions = set(rng.sample(range(blocks), min(images, blocks)))
+    count = 0
+    next_heading = 0
+    while count < blocks:
+        if count >= next_heading:
+            block = text_block("heading_2", f"Tema {count // section_size + 1}")
+            next_heading += section_size
+        elif count in image_positions:
+            image_id = str(uuid.uuid4())
+            block = {
+                "object": "block", "id": image_id, "type": "image", "has_children": False,
+                "last_edited_time": "2024-01-01T00:00:00.000Z",
+                "image": {"type": "file", "caption": [{"plain_text": f"Figura {count}"}],
+                          "file": {"url": f"{files_url}/files/{image_id}.png?X-Amz-Signature={uuid.uuid4().hex}"}}
+            }
+        elif count % nested_every == nested_every - 1 and count + 1 < blocks:
+            block = text_block("bulleted_list_item", " ".join(rng.choices(words, k=8)), has_children=True)
+            tree[block["id"]] = [text_block("paragraph", " ".join(rng.choices(words, k=12)))]
+            count += 1
+        else:
+            block = text_block("paragraph", " ".join(rng.choices(words, k=rng.randint(8, 40))))
+        tree["page"].append(block)
+        count += 1
+    return tree
+
+
+class RateLimiter:
+    # Server side token bucket, answers how long the client has to wait (0 if it can go on)
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def check(self):
+        if not self.rate:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+
+class FakeService:
+    """Base of the fake services: routing by method and path regex, latency and rate limit."""
+
+    routes = []
+
+    def __init__(self, latency=0.0, rate_limit=None):
+        self.latency = latency
+        self.limiter = RateLimiter(rate_limit)
+        self.requests = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def handle_any(self):
+                service.handle(self)
+
+            do_GET = do_POST = do_PATCH = do_DELETE = do_PUT = handle_any
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, request):
+        with self.lock:
+            self.requests += 1
+        length = int(request.headers.get("Content-Length") or 0)
+        body = request.rfile.read(length) if length else b""
+        wait = self.limiter.check()
+        if wait:
+            with self.lock:
+                self.throttled += 1
+            return self.respond(request, 429, {"object": "error", "code": "rate_limited"},
+                                {"Retry-After": f"{wait:.3f}"})
+        if self.latency:
+            time.sleep(self.latency)
+        parsed = urlparse(request.path)
+        for method, pattern, name in self.routes:
+            match = re.fullmatch(pattern, parsed.path)
+            if method == request.command and match:
+                status, payload = getattr(self, name)(request, body, parse_qs(parsed.query), *match.groups())
+                if status is None:
+                    # The handler already wrote a streamed response
+                    return
+                return self.respond(request, status, payload)
+        self.respond(request, 404, {"error": f"no route for {request.command} {parsed.path}"})
+
+    @staticmethod
+    def respond(request, status, payload, headers=None):
+        if isinstance(payload, (bytes, bytearray)):
+            data, content_type = bytes(payload), "application/octet-stream"
+        else:
+            data, content_type = json.dumps(payload).encode("utf-8"), "application/json"
+        request.send_response(status)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            request.send_header(key, value)
+        request.end_headers()
+        request.wfile.write(data)
+
+
+class FakeNotion(FakeService):
+    routes = [
+        ("GET", r"/v1/blocks/([^/]+)/children", "get_children"),
+        ("PATCH", r"/v1/blocks/([^/]+)/children", "append_children"),
+        ("POST", r"/v1/pages", "create_page"),
+        ("PATCH", r"/v1/pages/([^/]+)", "update_page"),
+        ("POST", r"/v1/search", "search"),
+    ]
+
+    def __init__(self, pages, latency=0.0, rate_limit=None, page_size=100):
+        # pages: {page id: tree from build_page}
+        super().__init__(latency, rate_limit)
+        self.page_size = page_size
+        self.children = {}
+        self.pages = {}
+        for page_id, tree in pages.items():
+            self.add_page(page_id, tree)
+        self.appended = 0
+
+    def add_page(self, page_id, tree, last_edited_time="2024-01-01T00:00:00.000Z"):
+        for parent, blocks in tree.items():
+            self.children[page_id if parent == "page" else parent] = blocks
+        self.pages[page_id] = {"object": "page", "id": page_id, "last_edited_time": last_edited_time,
+                               "archived": False, "url": f"https://www.notion.so/{page_id.replace('-', '')}"}
+
+    @staticmethod
+    def dashed(block_id):
+        # Notion takes the ids with or without dashes
+        return str(uuid.UUID(block_id)) if len(block_id) == 32 else block_id
+
+    def get_children(self, request, body, query, block_id):
+        blocks = self.children.get(self.dashed(block_id), [])
+        page_size = min(int(query.get("page_size", [self.page_size])[0]), self.page_size)
+        start = int(query.get("start_cursor", ["0"])[0])
+        end = start + page_size
+        return 200, {"object": "list", "results": blocks[start:end], "has_more": end < len(blocks),
+                     "next_cursor": str(end) if end < len(blocks) else None}
+
+    def append_children(self, request, body, query, block_id):
+        children = json.loads(body)["children"]
+        if len(children) > 100:
+            return 400, {"object": "error", "code": "validation_error", "message": "children length > 100"}
+        results = []
+        for child in children:
+            child = dict(child, id=str(uuid.uuid4()), has_children=bool(child.get(child["type"], {}).get("children")))
+            results.append(child)
+        self.children.setdefault(self.dashed(block_id), []).extend(results)
+        with self.lock:
+            self.appended += len(results)
+        return 200, {"object": "list", "results": results}
+
+    def create_page(self, request, body, query):
+        page_id = str(uuid.uuid4())
+        self.pages[page_id] = {"object": "page", "id": page_id, "archived": False,
+                               "last_edited_time": "2024-01-01T00:00:00.000Z",
+                               "url": f"https://www.notion.so/TempPage-{page_id.replace('-', '')}"}
+        self.children[page_id] = json.loads(body).get("children", [])
+        return 200, self.pages[page_id]
+
+    def update_page(self, request, body, query, page_id):
+        page_id = self.dashed(page_id)
+        page = self.pages.setdefault(page_id, {"object": "page", "id": page_id})
+        page.update(json.loads(body))
+        return 200, page
+
+    def search(self, request, body, query):
+        # Pages sorted by last_edited_time descending, like the real search with a timestamp sort
+        data = json.loads(body or b"{}")
+        pages = sorted(self.pages.values(), key=lambda page: page["last_edited_time"], reverse=True)
+        start = int(data.get("start_cursor") or 0)
+        end = start + min(data.get("page_size", 100), 100)
+        return 200, {"object": "list", "results": pages[start:end], "has_more": end < len(pages),
+                     "next_cursor": str(end) if end < len(pages) else None}
+
+
+class FakeFiles(FakeService):
+    # Host of the files of the Notion image blocks (S3 in the real thing)
+    routes = [("GET", r"/files/([^/]+)", "get_file")]
+
+    def __init__(self, image_size=(256, 256), latency=0.0):
+        super().__init__(latency)
+        self.image_size = image_size
+        self.cache = {}
+
+    def get_file(self, request, body, query, name):
+        if name not in self.cache:
+            self.cache[name] = make_png(*self.image_size, seed=hash(name))
+        return 200, self.cache[name]
+
+
+class FakeCloudinary(FakeService):
+    routes = [
+        ("POST", r"/v1_1/([^/]+)/image/upload", "upload"),
+        ("GET", r"/res/([^/]+)", "get_resource"),
+        ("DELETE", r"/v1_1/([^/]+)/resources/image/upload", "delete_resources"),
+    ]
+
+    def __init__(self, latency=0.0, rate_limit=None):
+        super().__init__(latency, rate_limit)
+        self.resources = {}
+        self.uploaded_bytes = 0
+
+    def upload(self, request, body, query, cloud_name):
+        # The multipart body is not parsed, the public_id field is enough for the benchmark
+        match = re.search(rb'name="public_id"\r\n\r\n([^\r]+)', body)
+        public_id = match.group(1).decode() if match else uuid.uuid4().hex
+        self.resources[public_id] = body
+        with self.lock:
+            self.uploaded_bytes += len(body)
+        url = f"{self.url}/res/{public_id}.png"
+        return 200, {"public_id": public_id, "url": url, "secure_url": url, "bytes": len(body),
+                     "format": "png", "resource_type": "image"}
+
+    def get_resource(self, request, body, query, name):
+        if name.rsplit(".", 1)[0] not in self.resources:
+            return 404, {"error": "not found"}
+        return 200, make_png(16, 16)
+
+    def delete_resources(self, request, body, query, cloud_name):
+        # The SDK sends the ids in a JSON body, older versions as form or query parameters
+        public_ids = query.get("public_ids[]", [])
+        if not public_ids and body:
+            if body.startswith(b"{"):
+                public_ids = json.loads(body).get("public_ids", [])
+            else:
+                public_ids = parse_qs(body.decode()).get("public_ids[]", [])
+        deleted = {}
+        for public_id in public_ids:
+            deleted[public_id] = "deleted" if self.resources.pop(public_id, None) is not None else "not_found"
+        return 200, {"deleted": deleted}
+
+
+def fake_cards(notes):
+    # Deterministic "LLM": a card for every line of the notes that is not a heading
+    cards = []
+    for line in notes.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        image = None
+        if " : http" in line:
+            image = line.split(" : ", 1)[1]
+        cards.append({"question": f"¿Qué significa: {line[:60]}?", "answer": line, "image": image})
+    return {"anki": cards}
+
+
+class FakeOpenAI(FakeService):
+    routes = [
+        ("POST", r"/v1/chat/completions", "chat_completion"),
+        ("POST", r"/v1/files", "create_file"),
+        ("GET", r"/v1/files/([^/]+)/content", "file_content"),
+        ("POST", r"/v1/batches", "create_batch"),
+        ("GET", r"/v1/batches/([^/]+)", "get_batch"),
+    ]
+
+    def __init__(self, latency=0.0, seconds_per_token=0.0, rate_limit=None):
+        super().__init__(latency, rate_limit)
+        self.seconds_per_token = seconds_per_token
+        self.prefixes = set()
+        self.files = {}
+        self.batches = {}
+
+    def completion(self, body):
+        messages = body["messages"]
+        notes = messages[-1]["content"]
+        content = json.dumps(fake_cards(notes))
+        prefix = json.dumps(messages[:-1])
+        prompt_tokens = len(json.dumps(messages)) // 4
+        # Like the provider cache: the fixed prefix is cached after the first request that uses it
+        cached_tokens = len(prefix) // 4 if prefix in self.prefixes else 0
+        self.prefixes.add(prefix)
+        completion_tokens = len(content) // 4
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion", "created": int(time.time()),
+            "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop", "logprobs": None,
+                         "message": {"role": "assistant", "content": content, "refusal": None}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens,
+                      "prompt_tokens_details": {"cached_tokens": cached_tokens}}
+        }
+
+    def chat_completion(self, request, body, query):
+        data = json.loads(body)
+        result = self.completion(data)
+        if data.get("stream"):
+            self.stream_completion(request, result)
+            return None, None
+        time.sleep(result["usage"]["completion_tokens"] * self.seconds_per_token)
+        return 200, result
+
+    def stream_completion(self, request, result, piece_size=16):
+        # Server-sent events like the real API: the content in small deltas and the usage at the end
+        request.send_response(200)
+        request.send_header("Content-Type", "text/event-stream")
+        request.send_header("Connection", "close")
+        request.end_headers()
+        request.close_connection = True
+        content = result["choices"][0]["message"]["content"]
+        base = {"id": result["id"], "object": "chat.completion.chunk", "created": result["created"],
+                "model": result["model"]}
+
+        def send(chunk):
+            request.wfile.write(f"data: {json.dumps(dict(base, **chunk))}\n\n".encode("utf-8"))
+            request.wfile.flush()
+
+        send({"choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]})
+        for start in range(0, len(content), piece_size):
+            piece = content[start:start + piece_size]
+            time.sleep(len(piece) / 4 * self.seconds_per_token)
+            send({"choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]})
+        send({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        send({"choices": [], "usage": result["usage"]})
+        request.wfile.write(b"data: [DONE]\n\n")
+        request.wfile.flush()
+
+    def create_file(self, request, body, query):
+        # Only the jsonl content of the multipart body is kept
+        lines = [line for line in body.split(b"\r\n") if line.startswith(b"{")]
+        file_id = f"file-{uuid.uuid4().hex}"
+        self.files[file_id] = b"\n".join(lines)
+        return 200, {"id": file_id, "object": "file", "bytes": len(body), "created_at": int(time.time()),
+                     "filename": "batch.jsonl", "purpose": "batch", "status": "processed"}
+
+    def file_content(self, request, body, query, file_id):
+        return 200, self.files[file_id]
+
+    def create_batch(self, request, body, query):
+        data = json.loads(body)
+        output = []
+        for line in self.files[data["input_file_id"]].splitlines():
+            item = json.loads(line)
+            output.append(json.dumps({"id": uuid.uuid4().hex, "custom_id": item["custom_id"], "error": None,
+                                      "response": {"status_code": 200, "body": self.completion(item["body"])}}))
+        output_id = f"file-{uuid.uuid4().hex}"
+        self.files[output_id] = "\n".join(output).encode("utf-8")
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        self.batches[batch_id] = {
+            "id": batch_id, "object": "batch", "endpoint": data["endpoint"], "input_file_id": data["input_file_id"],
+            "completion_window": data["completion_window"], "status": "completed", "output_file_id": output_id,
+            "error_file_id": None, "created_at": int(time.time())
+        }
+        return 200, dict(self.batches[batch_id], status="in_progress", output_file_id=None)
+
+    def get_batch(self, request, body, query, batch_id):
+        return 200, self.batches[batch_id]
+
+
+class FakeAnkiConnect(FakeService):
+    routes = [("POST", r"/?", "action")]
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.decks = {"Default": []}
+        self.models = ["Basic"]
+        self.notes = {}
+        self.media = {}
+
+    def action(self, request, body, query):
+        data = json.loads(body)
+        try:
+            return 200, {"result": self.run(data["action"], data.get("params", {})), "error": None}
+        except Exception as e:
+            return 200, {"result": None, "error": str(e)}
+
+    def run(self, action, params):
+        if action == "multi":
+            results = []
+            for item in params["actions"]:
+                try:
+                    results.append({"result": self.run(item["action"], item.get("params", {})), "error": None})
+                except Exception as e:
+                    results.append({"result": None, "error": str(e)})
+            return results
+        if action == "createDeck":
+            self.decks.setdefault(params["deck"], [])
+            return abs(hash(params["deck"]))
+        if action == "deckNames":
+            return list(self.decks)
+        if action == "modelNames":
+            return self.models
+        if action == "createModel":
+            self.models.append(params["modelName"])
+            return {"name": params["modelName"]}
+        if action == "storeMediaFile":
+            self.media[params["filename"]] = params
+            return params["filename"]
+        if action == "addNotes":
+            return [self.add_note(note, raise_errors=False) for note in params["notes"]]
+        if action == "addNote":
+            return self.add_note(params["note"])
+        if action == "findNotes":
+            deck = params["query"].split("deck:", 1)[-1].strip('"')
+            return [note_id for note_id, note in self.notes.items() if note["deckName"] == deck]
+        if action == "notesInfo":
+            return [{"noteId": note_id, "modelName": self.notes[note_id]["modelName"],
+                     "fields": {name: {"value": value, "order": order}
+                                for order, (name, value) in enumerate(self.notes[note_id]["fields"].items())}}
+                    for note_id in params["notes"]]
+        if action == "importPackage":
+            return True
+        if action in ("findCards",):
+            return []
+        if action in ("changeDeck", "deleteDecks"):
+            return None
+        raise ValueError(f"unsupported action {action}")
+
+    def add_note(self, note, raise_errors=True):
+        for existing in self.notes.values():
+            if existing["deckName"] == note["deckName"] and existing["fields"] == note["fields"]:
+                if raise_errors:
+                    raise ValueError("cannot create note because it is a duplicate")
+                return None
+        note_id = int(time.time() * 1000) * 1000 + len(self.notes)
+        self.notes[note_id] = note
+        self.decks.setdefault(note["deckName"], []).append(note_id)
+        return note_id
+
+
+class FakeServices:
+    """Start every fake service, use it as a context manager."""
+
+    def __init__(self, pages, latency=0.0, notion_rate_limit=None, openai_seconds_per_token=0.0, image_size=(256, 256),
+                 notion_page_size=100):
+        self.notion = FakeNotion(pages, latency, notion_rate_limit, notion_page_size)
+        self.files = FakeFiles(image_size, latency)
+        self.cloudinary = FakeCloudinary(latency)
+        self.openai = FakeOpenAI(latency, openai_seconds_per_token)
+        self.anki = FakeAnkiConnect(latency)
+        self.all = [self.notion, self.files, self.cloudinary, self.openai, self.anki]
+
+    def __enter__(self):
+        for service in self.all:
+            service.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        for service in self.all:
+            service.stop()
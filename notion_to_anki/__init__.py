@@ -0,0 +1,6 @@
+"""
+Notion to Anki: turn the notes of a Notion page into Anki cards with an LLM.
+
+The backends (notion, llm, media, export, anki) import their heavy dependencies when they are first
+used, so importing the package or running a command only loads what that command needs.
+"""
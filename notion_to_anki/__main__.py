@@ -0,0 +1,8 @@
+import sys
+
+from .cli import main
+
+
+# The image workers are spawned and import the main module again, they must not run the command
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,42 @@
+import requests
+
+
+ANKI_CONNECT_URL = "http://localhost:8765"
+ANKI_CONNECT_VERSION = 6
+
+
+class AnkiConnectError(Exception):
+    pass
+
+
+class AnkiConnect:
+    """Client for AnkiConnect, every call goes through one keep-alive session."""
+
+    def __init__(self, url=ANKI_CONNECT_URL, version=ANKI_CONNECT_VERSION, timeout=120):
+        self.url = url
+        self.version = version
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def invoke(self, action, **params):
+        response = self.session.post(
+            self.url, json={"action": action, "version": self.version, "params": params}, timeout=self.timeout
+        )
+        response.raise_for_status()
+        data = response.json()
+        if data.get("error") is not None:
+            raise AnkiConnectError(f"{action}: {data['error']}")
+        return data["result"]
+
+    def multi(self, actions):
+        """
+        Run several actions in a single request. actions are (action, params) pairs, returns a
+        list of (result, error) in the same order, the errors are not raised.
+        """
+        results = self.invoke("multi", actions=[
+            {"action": action, "version": self.version, "params": params} for action, params in actions
+        ])
+        return [
+            (result.get("result"), result.get("error")) if isinstance(result, dict) else (result, None)
+            for result in results
+        ]
@@ -0,0 +1,191 @@
+import hashlib
+import html
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import zipfile
+
+
+# Anki collection schema (version 11), the one every Anki version can import
+APKG_SCHEMA = """
+CREATE TABLE col (
+    id integer primary key, crt integer not null, mod integer not null, scm integer not null,
+    ver integer not null, dty integer not null, usn integer not null, ls integer not null,
+    conf text not null, models text not null, decks text not null, dconf text not null, tags text not null
+);
+CREATE TABLE notes (
+    id integer primary key, guid text not null, mid integer not null, mod integer not null,
+    usn integer not null, tags text not null, flds text not null, sfld integer not null,
+    csum integer not null, flags integer not null, data text not null
+);
+CREATE TABLE cards (
+    id integer primary key, nid integer not null, did integer not null, ord integer not null,
+    mod integer not null, usn integer not null, type integer not null, queue integer not null,
+    due integer not null, ivl integer not null, factor integer not null, reps integer not null,
+    lapses integer not null, left integer not null, odue integer not null, odid integer not null,
+    flags integer not null, data text not null
+);
+CREATE TABLE revlog (
+    id integer primary key, cid integer not null, usn integer not null, ease integer not null,
+    ivl integer not null, lastIvl integer not null, factor integer not null, time integer not null,
+    type integer not null
+);
+CREATE TABLE graves (usn integer not null, oid integer not null, type integer not null);
+CREATE INDEX ix_notes_usn on notes (usn);
+CREATE INDEX ix_cards_usn on cards (usn);
+CREATE INDEX ix_revlog_usn on revlog (usn);
+CREATE INDEX ix_cards_nid on cards (nid);
+CREATE INDEX ix_cards_sched on cards (did, queue, due);
+CREATE INDEX ix_revlog_cid on revlog (cid);
+CREATE INDEX ix_notes_csum on notes (csum);
+"""
+
+# Fixed so every exported deck uses the same note type in the collection
+MODEL_ID = 1718453921
+MODEL_NAME = "NotionToAnki Basic"
+MODEL_FIELDS = ["Front", "Back"]
+MODEL_QFMT = "{{Front}}"
+MODEL_AFMT = "{{FrontSide}}\n\n<hr id=answer>\n\n{{Back}}"
+MODEL_CSS = """.card {
+    font-family: arial;
+    font-size: 20px;
+    text-align: center;
+    color: black;
+    background-color: white;
+}
+img {
+    max-width: 100%;
+}
+"""
+
+DEFAULT_CONF = {
+    "activeDecks": [1], "curDeck": 1, "newSpread": 0, "collapseTime": 1200, "timeLim": 0, "estTimes": True,
+    "dueCounts": True, "curModel": None, "nextPos": 1, "sortType": "noteFld", "sortBackwards": False,
+    "addToCur": True
+}
+
+DEFAULT_DCONF = {
+    "1": {
+        "id": 1, "name": "Default", "mod": 0, "usn": 0, "maxTaken": 60, "autoplay": True, "timer": 0,
+        "replayq": True,
+        "new": {"bury": True, "delays": [1, 10], "initialFactor": 2500, "ints": [1, 4, 7], "order": 1,
+                "perDay": 20, "separate": True},
+        "lapse": {"delays": [10], "leechAction": 0, "leechFails": 8, "minInt": 1, "mult": 0},
+        "rev": {"bury": True, "ease4": 1.3, "fuzz": 0.05, "ivlFct": 1, "maxIvl": 36500, "minSpace": 1,
+                "perDay": 100}
+    }
+}
+
+
+def deck_id(deck_name):
+    # Stable id so exporting to the same deck twice targets the same deck
+    return int(hashlib.sha1(deck_name.encode("utf-8")).hexdigest()[:12], 16) % (1 << 62)
+
+
+def note_guid(deck_name, question):
+    # Anki updates the note with the same guid instead of adding a duplicate on import
+    return hashlib.sha1(f"{deck_name}\x1f{question}".encode("utf-8")).hexdigest()[:16]
+
+
+def field_checksum(text):
+    return int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:8], 16)
+
+
+def to_html(text):
+    return html.escape(text).replace("\n", "<br>")
+
+
+def build_deck(did, deck_name, now):
+    return {
+        "id": did, "name": deck_name, "desc": "", "conf": 1, "dyn": 0, "collapsed": False, "usn": -1,
+        "mod": now, "extendNew": 10, "extendRev": 50, "newToday": [0, 0], "revToday": [0, 0],
+        "lrnToday": [0, 0], "timeToday": [0, 0]
+    }
+
+
+def build_model(did, now):
+    return {
+        "id": MODEL_ID, "name": MODEL_NAME, "type": 0, "mod": now, "usn": -1, "sortf": 0, "did": did,
+        "tags": [], "vers": [], "css": MODEL_CSS, "req": [[0, "all", [0]]],
+        "latexPre": "\\documentclass[12pt]{article}\n\\special{papersize=3in,5in}\n\\usepackage[utf8]{inputenc}\n"
+                    "\\usepackage{amssymb,amsmath}\n\\pagestyle{empty}\n\\setlength{\\parindent}{0in}\n"
+                    "\\begin{document}\n",
+        "latexPost": "\\end{document}",
+        "flds": [
+            {"name": name, "ord": ord, "font": "Arial", "size": 20, "media": [], "rtl": False, "sticky": False}
+            for ord, name in enumerate(MODEL_FIELDS)
+        ],
+        "tmpls": [{
+            "name": "Card 1", "ord": 0, "did": None, "bqfmt": "", "bafmt": "",
+            "qfmt": MODEL_QFMT,
+            "afmt": MODEL_AFMT
+        }]
+    }
+
+
+def write_apkg(path, deck_name, cards, resolve_image=None):
+    """
+    Write an Anki package with one Front/Back note per card in the deck deck_name.
+    resolve_image(url) returns a local path for the image of a card (or None to leave it out),
+    the file is embedded in the package as media.
+    Returns the number of notes written.
+    """
+    now = int(time.time())
+    now_ms = int(time.time() * 1000)
+    did = deck_id(deck_name)
+    # "media" maps the number of every file in the package to its name, media_paths to its local path
+    media = {}
+    media_paths = {}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        collection_path = os.path.join(temp_dir, "collection.anki2")
+        connection = sqlite3.connect(collection_path)
+        connection.executescript(APKG_SCHEMA)
+        connection.execute(
+            "INSERT INTO col VALUES (1, ?, ?, ?, 11, 0, 0, 0, ?, ?, ?, ?, '{}')",
+            (
+                now, now_ms, now_ms, json.dumps(DEFAULT_CONF),
+                json.dumps({str(MODEL_ID): build_model(did, now)}),
+                json.dumps({"1": build_deck(1, "Default", now), str(did): build_deck(did, deck_name, now)}),
+                json.dumps(DEFAULT_DCONF)
+            )
+        )
+
+        notes = []
+        card_rows = []
+        for index, card in enumerate(cards):
+            back = to_html(card.answer)
+            image_path = resolve_image(card.image) if card.image and resolve_image else None
+            if image_path:
+                file_name = os.path.basename(image_path)
+                if file_name not in media.values():
+                    number = str(len(media))
+                    media[number] = file_name
+                    media_paths[number] = image_path
+                back += f'<br><img src="{html.escape(file_name)}">'
+            elif card.image:
+                back += f'<br><img src="{html.escape(card.image)}">'
+            front = to_html(card.question)
+            note_id = now_ms + index
+            notes.append((
+                note_id, note_guid(deck_name, card.question), MODEL_ID, now, -1, "",
+                front + "\x1f" + back, card.question, field_checksum(card.question), 0, ""
+            ))
+            card_rows.append((note_id, note_id, did, 0, now, -1, 0, 0, index + 1, 0, 0, 0, 0, 0, 0, 0, 0, ""))
+        connection.executemany("INSERT INTO notes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", notes)
+        connection.executemany(
+            "INSERT INTO cards VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", card_rows
+        )
+        connection.commit()
+        connection.close()
+
+        temp_path = path + ".part"
+        with zipfile.ZipFile(temp_path, "w", zipfile.ZIP_DEFLATED) as package:
+            package.write(collection_path, "collection.anki2")
+            package.writestr("media", json.dumps(media))
+            for number, image_path in media_paths.items():
+                package.write(image_path, number)
+        os.replace(temp_path, path)
+    return len(notes)
@@ -0,0 +1,123 @@
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+from . import tracing
+from .config import ARTIFACTS_DB
+
+
+class ArtifactManifest:
+    """
+    Everything the runs leave behind, with the run that created it: the images uploaded to
+    Cloudinary, the TempPages created in Notion and the local files (exported decks, 2anki
+    downloads). The gc command deletes them in bulk. An artifact is only marked deleted once it is
+    gone, so an interrupted gc is just run again.
+    The images of the published cards are kept apart: the toggles in Notion and the cards in Anki
+    link to them for good, gc never deletes them.
+    """
+
+    def __init__(self, db_path):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS artifacts (
+                    kind TEXT NOT NULL,
+                    ref TEXT NOT NULL,
+                    run_id TEXT,
+                    created REAL NOT NULL,
+                    deleted REAL,
+                    PRIMARY KEY (kind, ref)
+                )""")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS published_images (
+                    ref TEXT PRIMARY KEY
+                )""")
+
+    def add(self, kind, ref, run_id=None):
+        # The first run that created an artifact keeps it, a run that reuses it doesn't
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO artifacts (kind, ref, run_id, created) VALUES (?, ?, ?, ?)",
+                (kind, ref, run_id, time.time())
+            )
+
+    def add_published(self, refs):
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR IGNORE INTO published_images (ref) VALUES (?)",
+                                        [(ref,) for ref in refs])
+
+    def published(self):
+        with self.lock:
+            return {row[0] for row in self.connection.execute("SELECT ref FROM published_images")}
+
+    def pending(self, kind, created_before):
+        # The artifacts of a kind not deleted yet, created before the given time
+        with self.lock:
+            return [row[0] for row in self.connection.execute(
+                "SELECT ref FROM artifacts WHERE kind = ? AND deleted IS NULL AND created < ? ORDER BY created",
+                (kind, created_before)
+            )]
+
+    def mark_deleted(self, kind, refs):
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "UPDATE artifacts SET deleted = ? WHERE kind = ? AND ref = ? AND deleted IS NULL",
+                [(time.time(), kind, ref) for ref in refs]
+            )
+
+    def purge(self, deleted_before):
+        # Forget the artifacts deleted long ago, the manifest doesn't grow with the runs
+        with self.lock, self.connection:
+            return self.connection.execute(
+                "DELETE FROM artifacts WHERE deleted IS NOT NULL AND deleted < ?", (deleted_before,)
+            ).rowcount
+
+    def close(self):
+        self.connection.close()
+
+
+def image_ref(url):
+    # Cloudinary public id of an image url, the images are named by their content hash
+    return os.path.splitext(os.path.basename(urlparse(url).path))[0]
+
+
+def open_manifest():
+    directory = os.path.dirname(ARTIFACTS_DB)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    return ArtifactManifest(ARTIFACTS_DB)
+
+
+def record_published(cards):
+    # The images of cards written to Notion or Anki, never deleted by gc
+    refs = {image_ref(card.image) for card in cards if card.image}
+    if not refs:
+        return
+    manifest = open_manifest()
+    try:
+        manifest.add_published(refs)
+    finally:
+        manifest.close()
+
+
+def record(kind, ref):
+    # Add an artifact of the current run to the manifest
+    manifest = open_manifest()
+    try:
+        manifest.add(kind, ref, tracing.tracer.run_id)
+    finally:
+        manifest.close()
+
+
+def forget(kind, refs):
+    # Mark artifacts deleted by the run itself (clean_files) so gc doesn't try again
+    if not os.path.exists(ARTIFACTS_DB):
+        return
+    manifest = ArtifactManifest(ARTIFACTS_DB)
+    try:
+        manifest.mark_deleted(kind, refs)
+    finally:
+        manifest.close()
@@ -0,0 +1 @@
+"""Services the sync talks to: Notion, the LLM, the image host, the deck exporters and Anki."""
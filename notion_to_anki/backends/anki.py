@@ -0,0 +1,199 @@
+import hashlib
+import html
+import os
+import threading
+from urllib.parse import urlparse
+
+from .. import tracing
+from ..tracing import traced
+from ..apkg import to_html, MODEL_NAME, MODEL_FIELDS, MODEL_QFMT, MODEL_AFMT, MODEL_CSS
+from ..config import ANKI_NOTES_BATCH, ANKI_ACTIONS_PER_MULTI, IMAGES_DIR, IMAGE_CACHE_DB, IMAGE_CACHE_MAX_BYTES
+from ..image_cache import ImageCache
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_anki():
+    # One keep-alive session for every AnkiConnect call, whatever thread makes it first
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from ..anki_connect import AnkiConnect
+                _client = AnkiConnect()
+    return _client
+
+def execute_action(action):
+    from ..anki_connect import AnkiConnectError
+
+    r = get_anki().session.post(get_anki().url, json=action)
+    r_json = r.json()
+    if r_json['error'] is not None:
+        raise AnkiConnectError(f"{action['action']}: {r_json['error']}")
+    return r_json
+
+@traced("import_anki_package")
+def import_anki_package(deck_path):
+    # The package already targets the destination deck, importing it is enough
+    action = {
+        "action": "importPackage",
+        "version": 6,
+        "params": {
+            "path": deck_path
+        }
+    }
+    execute_action(action)
+    print("Deck importado con éxito")
+
+@traced("two_anki_to_anki_connect")
+def two_anki_to_anki_connect(notion_deck_path, name_deck_destiny):
+    deckName = notion_deck_path.split('\\')[-1]
+    deckName = '.'.join(deckName.split('.')[:-1])
+    # Get only the name if the deck name is repeated
+    if deckName[-3] and deckName[-3] == '(' and deckName[-2].isdigit() and deckName[-1] == ')':
+        deckName = ' '.join(deckName.split(' ')[:-1])
+
+    action = {
+        "action": "importPackage",
+        "version": 6,
+        "params": {
+            "path": notion_deck_path
+        }
+    }
+    execute_action(action)
+
+
+    action = {
+        "action": "findCards",
+        "version": 6,
+        "params": {
+            "query": f"deck:{deckName}"
+        }
+    }
+    card_ids = execute_action(action)['result']
+    if len(card_ids) == 0:
+        raise RuntimeError(f"No cards found in the imported deck {deckName}")
+
+    action = {
+        "action": "changeDeck",
+        "version": 6,
+        "params": {
+            "cards": card_ids,
+            "deck": name_deck_destiny
+        }
+    }
+    execute_action(action)
+
+    # IMPORTANT: This function doesn't detect error
+    action = {
+        "action": "deleteDecks",
+        "version": 6,
+        "params": {
+            "decks": [deckName],
+            "cardsToo": True
+        }
+    }
+    execute_action(action)
+    print("Deck importado con éxito")
+
+def ensure_anki_model():
+    # The note type used by the cards, created in the collection the first time
+    if MODEL_NAME in get_anki().invoke("modelNames"):
+        return
+    get_anki().invoke(
+        "createModel",
+        modelName=MODEL_NAME,
+        inOrderFields=MODEL_FIELDS,
+        css=MODEL_CSS,
+        isCloze=False,
+        cardTemplates=[{"Name": "Card 1", "Front": MODEL_QFMT, "Back": MODEL_AFMT}]
+    )
+
+def store_card_images(cards, image_cache):
+    # Send the images to the Anki media folder in one request, returns url -> media file name
+    urls = list(dict.fromkeys(card.image for card in cards if card.image))
+    actions = []
+    file_names = {}
+    for url in urls:
+        path = image_cache.path_for_url(url)
+        extension = os.path.splitext(urlparse(url).path)[1] or ".png"
+        file_name = os.path.basename(path) if path else hashlib.sha256(url.encode("utf-8")).hexdigest()[:32] + extension
+        # AnkiConnect reads local files itself and downloads the rest
+        params = {"filename": file_name, "path": os.path.abspath(path)} if path else {"filename": file_name, "url": url}
+        actions.append(("storeMediaFile", params))
+        file_names[url] = file_name
+    if not actions:
+        return {}
+    for url, (result, error) in zip(urls, get_anki().multi(actions)):
+        if error is not None:
+            print("Error storing image in Anki:", url, error)
+            file_names.pop(url)
+    return file_names
+
+@traced("anki_to_anki_connect")
+def anki_to_anki_connect(formatted_content, name_deck_destiny):
+    """
+    Add the cards straight to the destination deck with AnkiConnect: images with storeMediaFile and the
+    notes with addNotes in chunks, several chunks per "multi" request.
+    The notes that can't be added are reported and returned, they don't stop the import.
+    """
+    cards = formatted_content.anki
+    get_anki().invoke("createDeck", deck=name_deck_destiny)
+    ensure_anki_model()
+    if not os.path.exists(IMAGES_DIR):
+        os.makedirs(IMAGES_DIR)
+    image_cache = ImageCache(IMAGE_CACHE_DB, IMAGE_CACHE_MAX_BYTES)
+    try:
+        image_names = store_card_images(cards, image_cache)
+    finally:
+        image_cache.close()
+
+    notes = []
+    for card in cards:
+        back = to_html(card.answer)
+        # The url comes from the model, escaped like in the .apkg so it can't break out of the attribute
+        if card.image in image_names:
+            back += f'<br><img src="{html.escape(image_names[card.image], quote=True)}">'
+        elif card.image:
+            back += f'<br><img src="{html.escape(card.image, quote=True)}">'
+        notes.append({
+            "deckName": name_deck_destiny,
+            "modelName": MODEL_NAME,
+            "fields": {"Front": to_html(card.question), "Back": back},
+            "options": {"allowDuplicate": False, "duplicateScope": "deck"},
+            "tags": ["NotionToAnki"]
+        })
+
+    chunks = [notes[i:i + ANKI_NOTES_BATCH] for i in range(0, len(notes), ANKI_NOTES_BATCH)]
+    added = 0
+    failed = []
+    for i in range(0, len(chunks), ANKI_ACTIONS_PER_MULTI):
+        multi_chunks = chunks[i:i + ANKI_ACTIONS_PER_MULTI]
+        results = get_anki().multi([("addNotes", {"notes": chunk}) for chunk in multi_chunks])
+        for chunk, (note_ids, error) in zip(multi_chunks, results):
+            if error is not None and not isinstance(note_ids, list):
+                # Newer AnkiConnect versions fail the whole action and list the reasons, retry one by one
+                note_ids = add_notes_one_by_one(chunk, failed)
+            for note, note_id in zip(chunk, note_ids):
+                if note_id is None:
+                    failed.append((note["fields"]["Front"], "could not be added"))
+                elif note_id is not False:
+                    added += 1
+    for question, error in failed:
+        print("Error adding note to Anki:", question, "-", error)
+    tracing.count("cards", added)
+    tracing.count("card_errors", len(failed))
+    return added, failed
+
+def add_notes_one_by_one(notes, failed):
+    # Returns the note ids like addNotes, False for the notes already reported in failed
+    note_ids = []
+    results = get_anki().multi([("addNote", {"note": note}) for note in notes])
+    for note, (note_id, error) in zip(notes, results):
+        if error is not None:
+            failed.append((note["fields"]["Front"], error))
+            note_ids.append(False)
+        else:
+            note_ids.append(note_id)
+    return note_ids
@@ -0,0 +1,165 @@
+import os
+import tempfile
+import time
+
+from .. import artifacts, tracing
+from ..tracing import traced
+from ..apkg import write_apkg
+from ..config import DOWNLOADS_DIR, DOWNLOAD_TIMEOUT, EXPORTS_DIR, IMAGES_DIR, IMAGE_CACHE_DB, IMAGE_CACHE_MAX_BYTES
+from ..download_watcher import DownloadWatcher
+from ..image_cache import ImageCache
+from .media import resolve_card_image
+from .notion import archive_page, page_id_from_url
+
+
+@traced("notion_to_2anki")
+def notion_to_2anki(temp_page_url):
+    from selenium import webdriver
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.chrome.options import Options
+
+    # Open Chrome with new profile bc of the remote debugging and default profile looks corrupted
+    # whateva is the directory where the new profile was created
+    port_chrome = 8989
+    os.system(f'start chrome --remote-debugging-port={port_chrome} --user-data-dir=C:\\Code\\whateva"')
+    chrome_options = Options()
+    chrome_options.add_experimental_option("debuggerAddress", "localhost:8989")
+    driver = webdriver.Chrome(options=chrome_options)
+    # Chrome is closed even when the export fails, the error is raised to the caller
+    try:
+        time.sleep(5)
+
+        # Every run downloads to its own folder, so only the files of this export are picked up
+        download_folder = os.path.abspath(os.path.join(DOWNLOADS_DIR, str(int(time.time() * 1000))))
+        os.makedirs(download_folder)
+        artifacts.record("file", download_folder)
+        driver.execute_cdp_cmd("Browser.setDownloadBehavior", {"behavior": "allow", "downloadPath": download_folder})
+
+        """
+        Notion
+        """
+
+        # Assuming you are already logged in Notion
+        driver.get(temp_page_url)
+        time.sleep(5)
+        driver.find_element(By.CLASS_NAME, "notion-topbar-more-button").click()
+        time.sleep(1)
+
+        # Get the export button by its svg icon
+        menu_item_with_arrow = driver.find_element(By.CSS_SELECTOR, 'div[role="menuitem"] svg.arrowUpLine')
+        export_button = menu_item_with_arrow.find_element(By.XPATH, './ancestor::div[@role="menuitem"]')
+        export_button.click()
+        time.sleep(1)
+
+        """
+        If HTML was selected previously, the selection will be remembered
+        """
+        # # Open the export format menu
+        # markdown_div = driver.find_element(By.XPATH, '//div[text()="Markdown & CSV"]')
+        # markdown_div.click()
+        # time.sleep(1)
+        #
+        # # Select HTML format
+        # html_div = driver.find_element(By.XPATH, '//div[text()="HTML"]')
+        # html_div.click()
+        # time.sleep(1)
+
+        # Click Export button, the zip with the Notion page is ready as soon as its download is renamed
+        with DownloadWatcher(download_folder, '.zip') as zip_watcher:
+            export_button = driver.find_element(By.XPATH, '//div[text()="Export"]')
+            export_button.click()
+            latest_file_path = zip_watcher.wait(DOWNLOAD_TIMEOUT)
+
+        """
+        2Anki
+        """
+
+        driver.get("https://2anki.net/")
+        time.sleep(5)
+
+        # Upload the notion page in .zip format and wait for the Anki deck to be downloaded
+        with DownloadWatcher(download_folder, '.apkg') as apkg_watcher:
+            file_input = driver.find_element(By.CLASS_NAME, 'file-input')
+            file_input.send_keys(latest_file_path)
+            latest_anki_deck_file_path = apkg_watcher.wait(DOWNLOAD_TIMEOUT)
+
+        # return the path of Notion page zip and the Anki deck file
+        return latest_file_path, latest_anki_deck_file_path
+    finally:
+        cerrar_chrome_por_puerto(port_chrome)
+        driver.quit()
+
+def encontrar_proceso_por_puerto(puerto):
+    import psutil
+
+    for process in psutil.process_iter(['pid', 'name', 'connections']):
+        try:
+            if process.info['name'] == 'chrome.exe':
+                for conn in process.connections(kind='inet'):
+                    if conn.laddr.port == puerto:  # Verifica si el puerto coincide
+                        return process  # Devuelve el proceso si lo encuentra
+        except (psutil.AccessDenied, psutil.NoSuchProcess):
+            pass
+    return None
+
+def cerrar_chrome_por_puerto(puerto):
+    proceso = encontrar_proceso_por_puerto(puerto)
+    if proceso:
+        proceso.terminate()  # Finaliza el proceso
+        print(f"Proceso de Chrome en el puerto {puerto} cerrado.")
+    else:
+        print(f"No se encontró un proceso de Chrome en el puerto {puerto}.")
+
+@traced("export_apkg")
+def export_apkg(formatted_content, deck_name):
+    # Write the .apkg of the cards directly in the destination deck, images are embedded as media
+    if not os.path.exists(EXPORTS_DIR):
+        os.makedirs(EXPORTS_DIR)
+    if not os.path.exists(IMAGES_DIR):
+        os.makedirs(IMAGES_DIR)
+    deck_path = os.path.abspath(os.path.join(EXPORTS_DIR, f"{int(time.time() * 1000)}.apkg"))
+    artifacts.record("file", deck_path)
+    image_cache = ImageCache(IMAGE_CACHE_DB, IMAGE_CACHE_MAX_BYTES)
+    resolved = {}
+    # The images downloaded for the deck are only needed until they are in the package
+    with tempfile.TemporaryDirectory() as download_dir:
+
+        def resolve_image(url):
+            if url not in resolved:
+                resolved[url] = resolve_card_image(url, image_cache, download_dir)
+            return resolved[url]
+
+        try:
+            notes_count = write_apkg(deck_path, deck_name, formatted_content.anki, resolve_image)
+        finally:
+            image_cache.close()
+    tracing.count("cards", notes_count)
+    tracing.count("bytes_apkg", os.path.getsize(deck_path))
+    return deck_path
+
+def clean_files(temp_page_url, notion_deck_path, notion_page_zip_path):
+    # Delete files from the download folder
+    try:
+        paths = [path for path in (notion_deck_path, notion_page_zip_path) if path is not None]
+        for path in paths:
+            os.remove(path)
+        # The download folder of the run is empty now
+        if notion_page_zip_path is not None:
+            os.rmdir(os.path.dirname(notion_page_zip_path))
+            paths.append(os.path.dirname(notion_page_zip_path))
+        if paths:
+            print("Archivos eliminados con éxito de Descargas")
+        artifacts.forget("file", paths)
+    except Exception as e:
+        print("Error deleting files from downloads folder:", e)
+
+    if temp_page_url is None:
+        return
+    # Delete the TempPage from Notion, gc retries it if this fails
+    id_page = page_id_from_url(temp_page_url)
+    try:
+        archive_page(id_page)
+        artifacts.forget("notion_page", [id_page])
+        print("Página de Notion Temp eliminada con éxito")
+    except Exception as e:
+        print("Error deleting TempPage from Notion:", e)
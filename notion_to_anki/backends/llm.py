@@ -0,0 +1,350 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import as_completed
+
+from .. import tracing
+from ..tracing import traced, TracedExecutor
+from ..config import (credential, OPENAI_MODEL, OPENAI_BASE_URL, LLM_MODES, BATCH_POLL_INTERVAL, CHUNK_MAX_TOKENS,
+                      LLM_WORKERS, STATE_DIR, LLM_CACHE_DB, LLM_CACHE_MAX_BYTES, LLM_CACHE_MAX_AGE)
+from ..llm_async import format_chunks_async, format_chunks_batch, response_format_param, ObjectStreamParser
+from ..llm_cache import LLMCache
+from ..models import Card, Anki
+from ..prompts import PROMPT_VERSION, build_messages
+
+
+def format_chunk(client, notes, language, usage=None):
+
+    """
+    Using structured output to get the response in JSON format
+    """
+
+    # Assuming max_tokens is by default the maximum value
+    completion = client.beta.chat.completions.parse(
+        model=OPENAI_MODEL,
+        messages=build_messages(notes, language),
+        response_format=Anki,
+    )
+    if usage is not None:
+        usage.add(completion.usage)
+
+    return completion.choices[0].message.parsed
+
+def format_chunk_stream(client, notes, language, usage=None, on_card=None):
+    """
+    Like format_chunk, but the structured output is streamed and every card is passed to on_card
+    as soon as its JSON object is complete, while the rest of the response is still being generated.
+    """
+    stream = client.chat.completions.create(
+        model=OPENAI_MODEL,
+        messages=build_messages(notes, language),
+        response_format=response_format_param(Anki),
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    parser = ObjectStreamParser(depth=2)
+    cards = []
+    for chunk in stream:
+        if chunk.usage is not None and usage is not None:
+            usage.add(chunk.usage)
+        if not chunk.choices or not chunk.choices[0].delta.content:
+            continue
+        for card in parser.feed(chunk.choices[0].delta.content):
+            card = Card.model_validate(card)
+            cards.append(card)
+            if on_card is not None:
+                on_card(card)
+    return Anki(anki=cards)
+
+class TokenUsage:
+    """Tokens used by the completions of a run, to check how much of the prompts come from the prefix cache."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+
+    def add(self, completion_usage):
+        if completion_usage is None:
+            return
+        details = getattr(completion_usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) or 0
+        with self.lock:
+            self.requests += 1
+            self.prompt_tokens += completion_usage.prompt_tokens
+            self.cached_tokens += cached_tokens
+            self.completion_tokens += completion_usage.completion_tokens
+
+    def report(self):
+        # The totals go to the span of the caller once, add() only sums them under its own lock
+        tracing.count("llm_requests", self.requests)
+        tracing.count("prompt_tokens", self.prompt_tokens)
+        tracing.count("cached_tokens", self.cached_tokens)
+        tracing.count("completion_tokens", self.completion_tokens)
+        hit_rate = self.cached_tokens / self.prompt_tokens * 100 if self.prompt_tokens else 0
+        print(f"Tokens ({self.requests} llamadas): prompt {self.prompt_tokens}, "
+              f"cacheados {self.cached_tokens} ({hit_rate:.1f}%), completion {self.completion_tokens}")
+
+_encoding = None
+
+def count_tokens(text):
+    # tiktoken is optional, without it ~4 characters per token is close enough for chunking
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.encoding_for_model(OPENAI_MODEL)
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return len(text) // 4 + 1
+
+def iter_note_sections(lines):
+    # Group the lines of the notes by "# " and "## " headings (heading_1 and heading_2)
+    section = []
+    for line in lines:
+        if section and (line.startswith("# ") or line.startswith("## ")):
+            yield section
+            section = []
+        section.append(line)
+    if section:
+        yield section
+
+def iter_chunks(lines, max_tokens=CHUNK_MAX_TOKENS):
+    """
+    Pack the lines of the notes in chunks that fit in max_tokens, cutting only before "# " and "## "
+    headings unless a single section is too big by itself, then it is cut by lines.
+    A chunk is yielded as soon as it is full and only the current chunk and section are kept, so the
+    lines can come straight from the converter of a page that is still being read.
+    """
+    chunk, chunk_tokens = [], 0
+    for section in iter_note_sections(lines):
+        section_tokens = count_tokens("\n".join(section))
+        if section_tokens > max_tokens:
+            # Too big to be kept together, its lines are packed like the sections
+            pieces = [[line] for line in section]
+        else:
+            pieces = [section]
+        for piece in pieces:
+            piece_tokens = count_tokens("\n".join(piece))
+            if chunk and chunk_tokens + piece_tokens > max_tokens:
+                text = "\n".join(chunk)
+                if text.strip():
+                    yield text
+                chunk, chunk_tokens = [], 0
+            chunk.extend(piece)
+            chunk_tokens += piece_tokens
+    if chunk and "\n".join(chunk).strip():
+        yield "\n".join(chunk)
+
+def split_notes(notes, max_tokens=CHUNK_MAX_TOKENS):
+    # The chunks of the notes text, see iter_chunks
+    return list(iter_chunks(notes.split("\n"), max_tokens))
+
+def normalize_question(question):
+    return " ".join(question.casefold().split())
+
+# Modes in which the chunks of several jobs are formatted together, see format_jobs
+JOBS_MODES = ["batch", "async"]
+
+_openai_client = None
+_openai_client_lock = threading.Lock()
+
+def get_openai_client():
+    # One client per process, it keeps its connections alive between calls. The format workers
+    # call it at the same time.
+    global _openai_client
+    if _openai_client is None:
+        with _openai_client_lock:
+            if _openai_client is None:
+                from openai import OpenAI
+                _openai_client = OpenAI(api_key=credential("OPENAI_API_KEY"), base_url=OPENAI_BASE_URL)
+    return _openai_client
+
+def format_chunks(chunks, language, mode, max_workers, usage, on_card=None, on_result=None):
+    # Format the chunks with the given mode, the results come in the order of the chunks.
+    # on_result(index, result) is called as soon as a chunk is done, so the responses already paid for
+    # are kept when another chunk fails. The first error is raised once every chunk finished.
+    if mode == "async":
+        # A single async client for every chunk of the run, bound to the event loop of the run
+        from openai import AsyncOpenAI
+
+        async def format_all():
+            async with AsyncOpenAI(api_key=credential("OPENAI_API_KEY"), base_url=OPENAI_BASE_URL) as client:
+                return await format_chunks_async(client, chunks, language, OPENAI_MODEL, Anki, max_workers, usage,
+                                                 on_result)
+        return asyncio.run(format_all())
+    if mode == "batch":
+        return format_chunks_batch(
+            get_openai_client(), chunks, language, OPENAI_MODEL, Anki, BATCH_POLL_INTERVAL, usage=usage,
+            on_result=on_result
+        )
+    client = get_openai_client()
+    if mode == "stream":
+        format_one = lambda chunk: format_chunk_stream(client, chunk, language, usage, on_card)
+    else:
+        format_one = lambda chunk: format_chunk(client, chunk, language, usage)
+    results = [None] * len(chunks)
+    errors = []
+    with TracedExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(format_one, chunk): index for index, chunk in enumerate(chunks)}
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                errors.append(e)
+                continue
+            if on_result is not None:
+                on_result(futures[future], results[futures[future]])
+    if errors:
+        raise errors[0]
+    return results
+
+def open_llm_cache():
+    if not os.path.exists(STATE_DIR):
+        os.makedirs(STATE_DIR)
+    return LLMCache(LLM_CACHE_DB, LLM_CACHE_MAX_BYTES, LLM_CACHE_MAX_AGE)
+
+@traced("format_jobs")
+def format_jobs(jobs, use_cache=True, mode="batch", max_workers=LLM_WORKERS):
+    """
+    Format the notes of several jobs together, before their format stage: in a single Batch job
+    (mode "batch") or with one AsyncOpenAI client and one limit of max_workers requests in flight
+    for all of them (mode "async"), instead of a Batch or a client per job.
+    jobs is a list of (sections, language) like the arguments of format_sections.
+    Returns the responses as JSON by cache key, for format_sections(prefetched=...). The cached chunks
+    are not sent and the responses are cached.
+    """
+    if mode not in JOBS_MODES:
+        raise ValueError(f"Unknown mode {mode} to format jobs together, expected one of {JOBS_MODES}")
+    cache = open_llm_cache() if use_cache else None
+    missing = {}
+    try:
+        for sections, language in jobs:
+            for notes in sections:
+                for chunk in split_notes(notes):
+                    key = LLMCache.make_key(PROMPT_VERSION, OPENAI_MODEL, language, chunk)
+                    if key not in missing and (cache is None or cache.get(key) is None):
+                        missing[key] = (chunk, language)
+        if not missing:
+            return {}
+        usage = TokenUsage()
+        keys = list(missing)
+        prefetched = {}
+
+        def store(index, result):
+            # Cached as they are read, the chunks that succeeded are not sent again if others failed
+            prefetched[keys[index]] = result.model_dump_json()
+            if cache is not None:
+                cache.put(keys[index], prefetched[keys[index]])
+
+        # format_chunks takes a list with the language of every chunk in these modes
+        format_chunks([chunk for chunk, language in missing.values()],
+                      [language for chunk, language in missing.values()], mode, max_workers, usage, on_result=store)
+    finally:
+        if cache is not None:
+            cache.close()
+    tracing.count("chunks_together", len(missing))
+    usage.report()
+    return prefetched
+
+@traced("format_with_openai")
+def format_sections(sections, language, max_workers=LLM_WORKERS, use_cache=True, mode="sync", on_card=None,
+                    prefetched=None):
+    """
+    Format several notes at once. Every notes is split in chunks that fit the token budget and all
+    the chunks are sent concurrently. Returns one Anki per notes, in the same order, with the
+    cards in page order and the repeated questions removed.
+    With use_cache=False the cached responses are ignored (and not updated).
+    mode is "sync" (thread pool), "async" (one AsyncOpenAI client), "batch" (one Batch job, slow but cheaper)
+    or "stream" (thread pool, the cards are parsed from the response while it is generated).
+    on_card is called once for every card that is not repeated as soon as it is known: the cached ones
+    first, then while they are generated in stream mode or when their chunk is done in the other modes.
+    prefetched are responses by cache key from format_jobs, used like the cached ones.
+    """
+    if mode not in LLM_MODES:
+        raise ValueError(f"Unknown LLM mode {mode}, expected one of {LLM_MODES}")
+    cache = open_llm_cache() if use_cache else None
+    prefetched = prefetched or {}
+    usage = TokenUsage()
+    seen_questions = set()
+    emitted = set()
+    emit_lock = threading.Lock()
+
+    def emit(card):
+        # Called from the worker threads in stream mode, a repeated question is never published
+        with emit_lock:
+            question = normalize_question(card.question)
+            if question in seen_questions:
+                return
+            seen_questions.add(question)
+            emitted.add(id(card))
+        on_card(card)
+
+    chunked = [split_notes(notes) for notes in sections]
+    chunks = [chunk for section_chunks in chunked for chunk in section_chunks]
+
+    # Only the chunks that are not cached go to the API
+    results = [None] * len(chunks)
+    keys = [LLMCache.make_key(PROMPT_VERSION, OPENAI_MODEL, language, chunk) for chunk in chunks]
+    for index, key in enumerate(keys):
+        cached = prefetched.get(key)
+        if cached is None and cache is not None:
+            cached = cache.get(key)
+        if cached is not None:
+            results[index] = Anki.model_validate_json(cached)
+            if on_card is not None:
+                for card in results[index].anki:
+                    emit(card)
+    missing = [index for index, result in enumerate(results) if result is None]
+
+    def store(position, result):
+        # Every chunk is cached once it is done, a failed chunk doesn't lose the responses of the others
+        if cache is not None:
+            cache.put(keys[missing[position]], result.model_dump_json())
+
+    try:
+        if missing:
+            formatted_chunks = format_chunks([chunks[index] for index in missing], language, mode, max_workers,
+                                             usage, emit if on_card is not None and mode == "stream" else None, store)
+            for index, result in zip(missing, formatted_chunks):
+                results[index] = result
+                if on_card is not None and mode != "stream":
+                    for card in result.anki:
+                        emit(card)
+    finally:
+        if cache is not None:
+            cache.evict()
+            cache.close()
+
+    formatted = []
+    position = 0
+    for section_chunks in chunked:
+        cards = []
+        for result in results[position:position + len(section_chunks)]:
+            for card in result.anki:
+                if on_card is not None:
+                    # The cards kept are the ones already published, they arrived in any order
+                    if id(card) in emitted:
+                        cards.append(card)
+                    continue
+                question = normalize_question(card.question)
+                if question in seen_questions:
+                    continue
+                seen_questions.add(question)
+                cards.append(card)
+        position += len(section_chunks)
+        formatted.append(Anki(anki=cards))
+    tracing.count("chunks", len(chunks))
+    batched = sum(1 for key in keys if key in prefetched)
+    tracing.count("llm_batched", batched)
+    tracing.count("llm_cache_hits", len(chunks) - len(missing) - batched)
+    tracing.count("cards", sum(len(formatted_content.anki) for formatted_content in formatted))
+    usage.report()
+    return formatted
+
+def format_with_openai(notes, language, use_cache=True, mode="sync"):
+    return format_sections([notes], language, use_cache=use_cache, mode=mode)[0]
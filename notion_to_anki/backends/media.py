@@ -0,0 +1,225 @@
+import hashlib
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future
+
+from .. import artifacts, tracing
+from ..tracing import traced, TracedExecutor
+from ..config import (credential, IMAGE_WORKERS, NOTES_LOOKAHEAD, DOWNLOAD_CHUNK_SIZE, IMAGES_DIR, IMAGE_CACHE_DB, IMAGE_CACHE_MAX_BYTES,
+                      IMAGE_MAX_SIZE, IMAGE_FORMAT, IMAGE_QUALITY, IMAGE_PROCESSES)
+from ..image_cache import ImageCache
+from ..notion_markdown import iter_markdown, rich_text_to_markdown
+
+
+_media_session = None
+_media_session_lock = threading.Lock()
+
+def get_media_session():
+    # Image downloads don't go to Notion (signed S3 urls or external hosts), so they use their own pool.
+    # The ingest threads call it at the same time.
+    global _media_session
+    if _media_session is None:
+        with _media_session_lock:
+            if _media_session is None:
+                import requests
+                session = requests.Session()
+                session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=IMAGE_WORKERS))
+                _media_session = session
+    return _media_session
+
+def configure_cloudinary():
+    import cloudinary
+    cloudinary.config(
+            cloud_name = credential("CLOUDINARY_CLOUD_NAME"),
+            api_key = credential("CLOUDINARY_API_KEY"),
+            api_secret = credential("CLOUDINARY_API_SECRET"),
+            secure=True
+        )
+
+def download_file(url, path):
+    # Stream the file to disk in chunks instead of holding it in memory, returns the sha256 of the content
+    temp_path = path + ".part"
+    sha256 = hashlib.sha256()
+    with get_media_session().get(url, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        with open(temp_path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+                sha256.update(chunk)
+                tracing.count("bytes_downloaded", len(chunk))
+    os.replace(temp_path, path)
+    return sha256.hexdigest()
+
+_image_pool = None
+_image_pool_lock = threading.Lock()
+
+def get_image_pool():
+    # One process pool for the whole run, started the first time an image is optimized. The ingest
+    # threads call it at the same time. The workers are spawned, forking a process with threads
+    # running can deadlock the children.
+    global _image_pool
+    if _image_pool is None:
+        with _image_pool_lock:
+            if _image_pool is None:
+                _image_pool = ProcessPoolExecutor(max_workers=IMAGE_PROCESSES,
+                                                  mp_context=multiprocessing.get_context("spawn"))
+    return _image_pool
+
+def shutdown_image_pool():
+    # Stop the workers at the end of a run, the next run starts a new pool
+    global _image_pool
+    with _image_pool_lock:
+        pool, _image_pool = _image_pool, None
+    if pool is not None:
+        pool.shutdown()
+
+def ingest_image(block, image_cache):
+    # Download an image block, optimize it and post it to Cloudinary.
+    # Returns the line for the notes and the size of the image before and after the optimization.
+    import cloudinary.uploader
+    from ..image_optimizer import optimize_image
+
+    image = block["image"]
+    image_info = rich_text_to_markdown(image["caption"])
+
+    # Unchanged block whose image is already in Cloudinary: nothing to download
+    content_hash = image_cache.get_block(block["id"], block["last_edited_time"])
+    new_url_image = image_cache.get(content_hash) if content_hash else None
+    original_size = optimized_size = 0
+    if new_url_image is None:
+        # Uploaded images are "file" and linked ones are "external"
+        download_path = os.path.join(IMAGES_DIR, f"{block['id']}.download")
+        content_hash = download_file(image[image["type"]]["url"], download_path)
+        # The CPU work goes to the process pool, this thread only waits for it. The workers keep the
+        # working directory they started in, so they get absolute paths.
+        new_image_path, original_size, optimized_size = get_image_pool().submit(
+            optimize_image, os.path.abspath(download_path), os.path.abspath(os.path.join(IMAGES_DIR, content_hash)),
+            IMAGE_MAX_SIZE, IMAGE_FORMAT, IMAGE_QUALITY
+        ).result()
+        new_url_image = image_cache.get(content_hash)
+        if new_url_image is None:
+            # Post the image to Cloudinary, named by its content so it is never uploaded twice
+            new_url_image = cloudinary.uploader.upload(new_image_path, public_id=content_hash, overwrite=False)["url"]
+            tracing.count("bytes_uploaded", os.path.getsize(new_image_path))
+            tracing.count("images_uploaded")
+            artifacts.record("cloudinary", content_hash)
+            image_cache.put(content_hash, new_url_image, new_image_path)
+        else:
+            image_cache.touch_path(content_hash, new_image_path)
+        image_cache.put_block(block["id"], block["last_edited_time"], content_hash)
+    return image_info + " : " + new_url_image, original_size, optimized_size
+
+def iter_notes(page_content, submit_image, image_bytes):
+    """
+    Yield the lines of the notes of a (block, depth) stream, in the order of the page.
+    submit_image(block) returns the future of the ingestion of an image block, its line is yielded
+    once it is ready while the text blocks keep flowing. At most NOTES_LOOKAHEAD lines are held back
+    behind an image, so the memory doesn't grow with the page. image_bytes gets the size of the
+    images before and after the optimization added to it.
+    """
+    def render_image(block, indent):
+        future = submit_image(block)
+        future.block = block
+        future.indent = indent
+        return future
+
+    def resolve(line):
+        if not isinstance(line, Future):
+            return line
+        try:
+            text, original_size, optimized_size = line.result()
+        except Exception as e:
+            print("Error processing block:", line.block, e)
+            tracing.count("image_errors")
+            return None
+        image_bytes[0] += original_size
+        image_bytes[1] += optimized_size
+        tracing.count("images")
+        return line.indent + text
+
+    waiting = deque()
+    for line in iter_markdown(page_content, render_image):
+        waiting.append(line)
+        while waiting and (not isinstance(waiting[0], Future) or waiting[0].done()
+                           or len(waiting) > NOTES_LOOKAHEAD):
+            line = resolve(waiting.popleft())
+            if line is not None:
+                yield line
+    for line in waiting:
+        line = resolve(line)
+        if line is not None:
+            yield line
+
+@traced("process_raw_notion_pages")
+def process_raw_notion_pages(sections):
+    # The notes of every (block, depth) list as compact Markdown, the images go to Cloudinary
+
+    if not os.path.exists(IMAGES_DIR):
+        os.makedirs(IMAGES_DIR)
+    image_cache = ImageCache(IMAGE_CACHE_DB, IMAGE_CACHE_MAX_BYTES)
+
+
+    configure_cloudinary()
+    image_bytes = [0, 0]
+    notes = []
+    with TracedExecutor(max_workers=IMAGE_WORKERS) as executor:
+        # The images of every section are submitted before the first one is waited on, a page with a
+        # figure per heading still ingests its images at the same time
+        image_futures = {
+            block["id"]: executor.submit(ingest_image, block, image_cache)
+            for blocks in sections for block, depth in blocks if block["type"] == "image"
+        }
+
+        def submit_image(block):
+            future = image_futures.pop(block["id"], None)
+            return future or executor.submit(ingest_image, block, image_cache)
+
+        for blocks in sections:
+            lines = []
+            for line in iter_notes(blocks, submit_image, image_bytes):
+                lines.append(line)
+                tracing.count("bytes_notes", len(line.encode("utf-8")) + 1)
+            notes.append("\n".join(lines))
+
+    image_cache.evict()
+    image_cache.close()
+    original_bytes, optimized_bytes = image_bytes
+    if original_bytes:
+        tracing.count("image_bytes_original", original_bytes)
+        tracing.count("image_bytes_saved", original_bytes - optimized_bytes)
+        print(f"Imágenes optimizadas: {(original_bytes - optimized_bytes) / 1024:.0f} KB ahorrados "
+              f"de {original_bytes / 1024:.0f} KB")
+    return notes
+
+def process_raw_notion_page(page_content):
+    # The notes of a single (block, depth) stream, see process_raw_notion_pages
+    return process_raw_notion_pages([list(page_content)])[0]
+
+def delete_cloudinary_images(public_ids):
+    # Delete up to 100 images in one Admin API call, returns the ids that are gone (deleted or not found)
+    import cloudinary.api
+
+    configure_cloudinary()
+    result = cloudinary.api.delete_resources(list(public_ids), resource_type="image", type="upload")
+    return [public_id for public_id, status in result["deleted"].items() if status in ("deleted", "not_found")]
+
+def resolve_card_image(url, image_cache, download_dir):
+    # Local copy of a card image to embed it in the deck. The images not in the image store are
+    # downloaded to download_dir, a temporary folder of the export: they are not in the cache, its
+    # eviction would never delete them from IMAGES_DIR.
+    from ..image_optimizer import detect_format, extension_for
+
+    path = image_cache.path_for_url(url)
+    if path:
+        return path
+    try:
+        download_path = os.path.join(download_dir, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".download")
+        content_hash = download_file(url, download_path)
+        path = os.path.join(download_dir, content_hash + extension_for(detect_format(download_path)))
+        os.replace(download_path, path)
+        return path
+    except Exception as e:
+        print("Error downloading image for the deck:", url, e)
+        return None
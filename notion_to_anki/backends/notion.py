@@ -0,0 +1,162 @@
+
+import threading
+
+from .. import artifacts, tracing
+from ..tracing import traced, TracedExecutor
+from ..block_writer import BlockWriter, WriteJournal, rich_text
+from ..config import credential, NOTION_BASE_URL, FETCH_WORKERS, WRITES_DIR
+
+
+# Blocks whose children are another page or database, not part of the page text
+unfetched_child_types = ["child_page", "child_database"]
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_notion():
+    # Shared by every Notion call: pooled keep-alive connections, rate limit and retries.
+    # Created on first use, a command that never talks to Notion doesn't need the key. The worker
+    # threads call it at the same time, two clients would each have their own rate limit.
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from ..notion_http import NotionClient
+                _client = NotionClient(credential("NOTION_API_KEY"), NOTION_BASE_URL)
+    return _client
+
+def iter_block_children(block_id):
+    # Yield the children of a block page by page, following the pagination cursor
+    params = {"page_size": 100}
+    while True:
+        response = get_notion().get(f"/blocks/{block_id}/children", params=params)
+        data = response.json()
+        yield data["results"]
+        if not data.get("has_more"):
+            return
+        params["start_cursor"] = data["next_cursor"]
+
+def iter_edited_pages(since=None, page_size=20):
+    # Pages shared with the integration, most recently edited first, until the first one edited before
+    # since (an ISO timestamp like Notion's). When nothing changed this is a single small request.
+    body = {
+        "filter": {"property": "object", "value": "page"},
+        "sort": {"timestamp": "last_edited_time", "direction": "descending"},
+        "page_size": page_size
+    }
+    while True:
+        data = get_notion().post("/search", json=body, idempotent=True).json()
+        for page in data["results"]:
+            if since is not None and page["last_edited_time"] < since:
+                return
+            yield page
+        if not data.get("has_more"):
+            return
+        body["start_cursor"] = data["next_cursor"]
+
+def fetch_block_children(block_id):
+    # Get all the children of a block (only one level)
+    children = []
+    for results in iter_block_children(block_id):
+        children.extend(results)
+    return children
+
+def walk_blocks(executor, blocks, depth):
+    # Children of every block in the batch are requested ahead, so they are usually
+    # ready by the time the walk reaches them. Workers never wait on other futures.
+    pending = {
+        block["id"]: executor.submit(fetch_block_children, block["id"])
+        for block in blocks
+        if block.get("has_children") and block["type"] not in unfetched_child_types
+    }
+    for block in blocks:
+        yield block, depth
+        if block["id"] in pending:
+            children = pending.pop(block["id"]).result()
+            yield from walk_blocks(executor, children, depth + 1)
+
+@traced("get_notion_page_content")
+def get_notion_page_content(page_id, max_workers=FETCH_WORKERS):
+    """
+    Yield (block, depth) for every block of a Notion page in reading order.
+    The whole block tree is walked, children are fetched concurrently while the caller consumes the stream.
+    """
+    with TracedExecutor(max_workers=max_workers) as executor:
+        for results in iter_block_children(page_id):
+            for block, depth in walk_blocks(executor, results, 0):
+                tracing.count("blocks")
+                yield block, depth
+
+def card_to_toggle(card):
+    toggle_block ={
+        "object": "block",
+        "type": "toggle",
+        "toggle": {
+            "rich_text": rich_text(card.question),
+            "color": "default",
+            "children": [
+                {
+                    "object": "block",
+                    "type": "paragraph",
+                    "paragraph": {
+                        "rich_text": rich_text(card.answer),
+                        "color": "default"
+                    }
+                }
+            ]
+        }
+    }
+    if card.image is not None:
+        toggle_block["toggle"]["children"].append({
+            "object": "block",
+            "type": "image",
+            "image": {
+                "type": "external",
+                "external": {
+                    "url": card.image
+                }
+            }
+        })
+    return toggle_block
+
+def page_id_from_url(url):
+    # https://www.notion.so/Title-<id> -> <id>
+    return url.split("/")[-1].split("-")[-1]
+
+def archive_page(page_id):
+    # Archive a page, a page already archived or deleted counts as archived
+    import requests
+
+    try:
+        get_notion().patch(f"/pages/{page_id}", json={"archived": True}, idempotent=True)
+    except requests.HTTPError as e:
+        if e.response is None or (e.response.status_code != 404 and "archived" not in e.response.text):
+            raise
+
+@traced("update_notion_page")
+def update_notion_page(page_id, formatted_content, create_temp_page=True, append_destination=True):
+    """
+    Actualiza una página de Notion con contenido en formato toggle list.
+    The toggles are appended in batches that fit the API limits, a failed run resumes from the last
+    batch Notion acknowledged. The TempPage is only created for the 2anki export, it is written at
+    the same time as the destination page. With append_destination=False only the TempPage is written
+    (the cards were streamed to the destination already).
+    """
+    # Convertir el contenido formateado en bloques de Notion
+    toggle_blocks = [card_to_toggle(card) for card in formatted_content.anki]
+    writer = BlockWriter(get_notion(), WriteJournal(WRITES_DIR))
+
+    temp_page_url = None
+    with TracedExecutor(max_workers=2) as executor:
+        # Send data to existing page
+        destination = executor.submit(writer.append, page_id, toggle_blocks) if append_destination else None
+        if create_temp_page:
+            # Create a new temporary page with the content
+            temp_page = executor.submit(writer.create_page, page_id, "TempPage", toggle_blocks)
+            temp_page_url = temp_page.result()
+            artifacts.record("notion_page", page_id_from_url(temp_page_url))
+        if destination is not None:
+            destination.result()
+    tracing.count("cards", len(toggle_blocks))
+
+    return temp_page_url
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+
+
+# Limits of the Notion API for a single append request
+MAX_CHILDREN_PER_REQUEST = 100
+MAX_BLOCKS_PER_REQUEST = 1000
+# The real limit is 500KB, some room is left for the rest of the request
+MAX_PAYLOAD_BYTES = 450 * 1024
+# Maximum length of the content of a single rich text object
+MAX_TEXT_LENGTH = 2000
+
+
+def rich_text(text):
+    # Notion rejects text objects longer than 2000 characters, long texts are split in several
+    pieces = [text[i:i + MAX_TEXT_LENGTH] for i in range(0, len(text), MAX_TEXT_LENGTH)] or [""]
+    return [{"type": "text", "text": {"content": piece, "link": None}} for piece in pieces]
+
+
+def count_blocks(block):
+    block_type = block["type"]
+    return 1 + sum(count_blocks(child) for child in block.get(block_type, {}).get("children", []))
+
+
+def split_batches(blocks):
+    # Group the blocks in batches that fit the children, nested blocks and payload size limits
+    batches = []
+    batch, batch_blocks, batch_bytes = [], 0, 0
+    for block in blocks:
+        block_count = count_blocks(block)
+        block_bytes = len(json.dumps(block).encode("utf-8"))
+        if batch and (len(batch) == MAX_CHILDREN_PER_REQUEST
+                      or batch_blocks + block_count > MAX_BLOCKS_PER_REQUEST
+                      or batch_bytes + block_bytes > MAX_PAYLOAD_BYTES):
+            batches.append(batch)
+            batch, batch_blocks, batch_bytes = [], 0, 0
+        batch.append(block)
+        batch_blocks += block_count
+        batch_bytes += block_bytes
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class WriteJournal:
+    """
+    Progress of the block writes, one JSON file per write so a failed run resumes after the last
+    batch Notion acknowledged instead of appending everything again.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        try:
+            with open(self.path(key), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def put(self, key, data):
+        # Written to a temporary file and renamed, so a crash never leaves half a journal
+        temp_path = self.path(key) + ".part"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(temp_path, self.path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+def write_key(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()[:32]
+
+
+class BlockWriter:
+    """Append blocks to a Notion page in batches that fit the API limits, resuming unfinished writes."""
+
+    def __init__(self, notion, journal):
+        self.notion = notion
+        self.journal = journal
+
+    def append(self, parent_id, blocks):
+        # Returns the ids of the top level blocks that were created, in order
+        batches = split_batches(blocks)
+        key = write_key("append", parent_id, blocks)
+        progress = self.journal.get(key)
+        acked = progress.get("acked", 0)
+        block_ids = progress.get("block_ids", [])
+        if acked:
+            print(f"Reanudando escritura en Notion desde el lote {acked + 1} de {len(batches)}")
+        # The batches go one after another to keep the order, the client paces them with its rate limiter
+        for batch in batches[acked:]:
+            response = self.notion.patch(f"/blocks/{parent_id}/children", json={"children": batch})
+            block_ids.extend(result["id"] for result in response.json()["results"])
+            acked += 1
+            self.journal.put(key, {"acked": acked, "block_ids": block_ids})
+        self.journal.delete(key)
+        return block_ids
+
+    def create_page(self, parent_id, title, blocks):
+        # Create an empty page and append the blocks to it, returns the page url
+        key = write_key("page", parent_id, title, blocks)
+        page = self.journal.get(key)
+        if not page:
+            response = self.notion.post("/pages", json={
+                "parent": {"type": "page_id", "page_id": parent_id},
+                "properties": {"title": {"title": [{"type": "text", "text": {"content": title}}]}}
+            })
+            page = {"id": response.json()["id"], "url": response.json()["url"]}
+            self.journal.put(key, page)
+        self.append(page["id"], blocks)
+        self.journal.delete(key)
+        return page["url"]
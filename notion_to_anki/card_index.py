@@ -0,0 +1,237 @@
+import hashlib
+import html
+import operator
+import re
+import sqlite3
+import struct
+import threading
+import time
+from collections import Counter
+
+
+# MinHash signatures with NUM_PERM values, split in BANDS bands for the LSH buckets.
+# With 16 bands of 4 rows two cards with a similarity of 0.7 share a bucket 98% of the time.
+# The signatures use one permutation hashing: every shingle is hashed once and goes to one of the
+# NUM_PERM bins, instead of being hashed NUM_PERM times.
+NUM_PERM = 64
+BANDS = 16
+SHINGLE_SIZE = 4
+NEAR_DUPLICATE_THRESHOLD = 0.7
+# notesInfo requests per AnkiConnect "multi" call when seeding, and notes per request
+SEED_NOTES_PER_REQUEST = 500
+SEED_REQUESTS_PER_MULTI = 8
+
+_EMPTY = 1 << 64
+
+
+def normalize_text(text):
+    # Anki fields are HTML and the cards Markdown, only the words are compared
+    text = html.unescape(re.sub(r"<[^>]+>", " ", text or ""))
+    text = re.sub(r"[^\w\s]", " ", text.casefold())
+    return " ".join(text.split())
+
+
+def card_text(question, answer):
+    return f"{normalize_text(question)} | {normalize_text(answer)}"
+
+
+def card_fingerprint(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+def card_entry(question, answer, note_id=None):
+    # What add_many stores for a card
+    text = card_text(question, answer)
+    return card_fingerprint(text), minhash(text), note_id
+
+
+def minhash(text):
+    # The hash is stable between runs (unlike hash()), the signatures stored in the index stay valid
+    bins = [_EMPTY] * NUM_PERM
+    for i in range(max(1, len(text) - SHINGLE_SIZE + 1)):
+        value = int.from_bytes(hashlib.blake2b(text[i:i + SHINGLE_SIZE].encode("utf-8"), digest_size=8).digest(),
+                               "big")
+        index, value = value % NUM_PERM, value // NUM_PERM
+        if value < bins[index]:
+            bins[index] = value
+    # Empty bins (short texts) borrow the value of the next bin that has one, shifted by the distance
+    filled = [index for index, value in enumerate(bins) if value != _EMPTY]
+    for index in range(NUM_PERM):
+        if bins[index] == _EMPTY:
+            distance = min((other - index) % NUM_PERM for other in filled)
+            bins[index] = (bins[(index + distance) % NUM_PERM] + distance * 0x9E3779B97F4A7C15) % _EMPTY
+    return bins
+
+
+def band_buckets(signature):
+    # One bucket per band, the cards that share any bucket are the candidates
+    rows = NUM_PERM // BANDS
+    return [
+        f"{band}:" + hashlib.blake2b(struct.pack(f"<{rows}Q", *signature[band * rows:(band + 1) * rows]),
+                                     digest_size=8).hexdigest()
+        for band in range(BANDS)
+    ]
+
+
+def similarity(signature, other):
+    # Estimated Jaccard similarity of the shingles of both cards
+    return sum(map(operator.eq, signature, other)) / NUM_PERM
+
+
+def pack_signature(signature):
+    return struct.pack(f"<{NUM_PERM}Q", *signature)
+
+
+def unpack_signature(data):
+    return list(struct.unpack(f"<{NUM_PERM}Q", data))
+
+
+class CardIndex:
+    """
+    Persistent index of the cards of every deck: an exact fingerprint of the normalized question and
+    answer, and a MinHash signature with its LSH buckets to find near duplicates without comparing
+    against the whole deck. Safe to use from several threads.
+    """
+
+    def __init__(self, db_path):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS cards (
+                    deck TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    note_id INTEGER,
+                    signature BLOB NOT NULL,
+                    added REAL NOT NULL,
+                    PRIMARY KEY (deck, fingerprint)
+                )""")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS buckets (
+                    deck TEXT NOT NULL,
+                    bucket TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL
+                )""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS buckets_lookup ON buckets (deck, bucket)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS cards_note ON cards (deck, note_id)")
+
+    def find(self, deck, fingerprint, signature):
+        # Returns the fingerprint of the card that matches (exact or near duplicate), None if there is none
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT fingerprint FROM cards WHERE deck = ? AND fingerprint = ?", (deck, fingerprint)
+            ).fetchone()
+            if row:
+                return row[0]
+            # Only the cards that share a bucket are compared, whatever the size of the deck
+            buckets = band_buckets(signature)
+            rows = self.connection.execute(
+                "SELECT DISTINCT cards.fingerprint, cards.signature FROM buckets "
+                "JOIN cards ON cards.deck = buckets.deck AND cards.fingerprint = buckets.fingerprint "
+                "WHERE buckets.deck = ? AND buckets.bucket IN (" + ", ".join("?" * len(buckets)) + ")",
+                [deck] + buckets
+            )
+            for candidate, candidate_signature in rows:
+                if similarity(signature, unpack_signature(candidate_signature)) >= NEAR_DUPLICATE_THRESHOLD:
+                    return candidate
+        return None
+
+    def add_many(self, deck, cards):
+        # cards are (fingerprint, signature, note_id) tuples, a known card only gets its note id updated
+        now = time.time()
+        with self.lock, self.connection:
+            for fingerprint, signature, note_id in cards:
+                exists = self.connection.execute(
+                    "SELECT 1 FROM cards WHERE deck = ? AND fingerprint = ?", (deck, fingerprint)
+                ).fetchone()
+                if exists:
+                    if note_id is not None:
+                        self.connection.execute(
+                            "UPDATE cards SET note_id = ? WHERE deck = ? AND fingerprint = ?",
+                            (note_id, deck, fingerprint)
+                        )
+                    continue
+                self.connection.execute(
+                    "INSERT INTO cards (deck, fingerprint, note_id, signature, added) VALUES (?, ?, ?, ?, ?)",
+                    (deck, fingerprint, note_id, pack_signature(signature), now)
+                )
+                self.connection.executemany(
+                    "INSERT INTO buckets (deck, bucket, fingerprint) VALUES (?, ?, ?)",
+                    [(deck, bucket, fingerprint) for bucket in band_buckets(signature)]
+                )
+
+    def note_ids(self, deck):
+        with self.lock:
+            return {row[0] for row in self.connection.execute(
+                "SELECT note_id FROM cards WHERE deck = ? AND note_id IS NOT NULL", (deck,)
+            )}
+
+    def seed(self, deck, anki):
+        """
+        Add the notes of the deck that are in Anki but not in the index yet. Only the new note ids are
+        requested with notesInfo, so after the first run seeding costs one findNotes call.
+        Returns the number of notes added.
+        """
+        note_ids = anki.invoke("findNotes", query=f'"deck:{deck}"')
+        missing = sorted(set(note_ids) - self.note_ids(deck))
+        chunks = [missing[i:i + SEED_NOTES_PER_REQUEST] for i in range(0, len(missing), SEED_NOTES_PER_REQUEST)]
+        added = 0
+        for i in range(0, len(chunks), SEED_REQUESTS_PER_MULTI):
+            cards = []
+            for notes, error in anki.multi([("notesInfo", {"notes": chunk})
+                                            for chunk in chunks[i:i + SEED_REQUESTS_PER_MULTI]]):
+                if error is not None:
+                    print("Error reading notes from Anki:", error)
+                    continue
+                for note in notes:
+                    fields = sorted(note["fields"].values(), key=lambda field: field["order"])
+                    if not fields:
+                        continue
+                    cards.append(card_entry(fields[0]["value"], fields[1]["value"] if len(fields) > 1 else "",
+                                            note["noteId"]))
+            self.add_many(deck, cards)
+            added += len(cards)
+        return added
+
+    def close(self):
+        self.connection.close()
+
+
+class DuplicateFilter:
+    """
+    Decide which cards of a run are new for a deck: not in the index and not a near duplicate of one.
+    The cards of the run are compared with each other too. Nothing is written to the index, the cards
+    are added once they are published, so a failed run doesn't hide its cards from the next one.
+    """
+
+    def __init__(self, index, deck):
+        self.index = index
+        self.deck = deck
+        self.lock = threading.Lock()
+        self.kept_signatures = {}
+        self.kept_buckets = {}
+        self.dropped = 0
+
+    def keep(self, question, answer):
+        text = card_text(question, answer)
+        fingerprint = card_fingerprint(text)
+        signature = minhash(text)
+        duplicate = self.index.find(self.deck, fingerprint, signature) is not None
+        buckets = band_buckets(signature)
+        with self.lock:
+            duplicate = duplicate or fingerprint in self.kept_signatures
+            if not duplicate:
+                # Every candidate once, however many buckets it shares, the ones sharing the most first
+                # (the likeliest duplicates) until the first match
+                shared = Counter()
+                for bucket in buckets:
+                    shared.update(self.kept_buckets.get(bucket, ()))
+                duplicate = any(similarity(signature, self.kept_signatures[candidate]) >= NEAR_DUPLICATE_THRESHOLD
+                                for candidate, _ in shared.most_common())
+            if duplicate:
+                self.dropped += 1
+                return False
+            self.kept_signatures[fingerprint] = signature
+            for bucket in buckets:
+                self.kept_buckets.setdefault(bucket, []).append(fingerprint)
+            return True
@@ -0,0 +1,143 @@
+"""
+Garbage collection of what the runs leave behind. Every run records its artifacts in the manifest
+(artifacts.py), gc deletes the ones older than the retention in bulk:
+
+- Cloudinary images in batches of 100 per Admin API call, only the ones no card ever used. The
+  images of every published card stay, the toggles in Notion and the cards in Anki link to them.
+- TempPages left by failed 2anki exports, archived through the rate limited Notion client.
+- Exported decks and 2anki downloads, partial image downloads and the checkpoints of old runs.
+
+The deletions run concurrently and an artifact is only marked deleted once it is gone, so gc can
+be interrupted and run again at any time.
+"""
+import os
+import shutil
+import time
+
+from . import tracing
+from .tracing import traced, TracedExecutor
+from .artifacts import ArtifactManifest, image_ref
+from .config import (ARTIFACTS_DB, CLOUDINARY_DELETE_BATCH, DOWNLOADS_DIR, EXPORTS_DIR, GC_WORKERS, IMAGES_DIR,
+                     IMAGE_CACHE_DB, IMAGE_CACHE_MAX_BYTES, RUNS_DIR, STATE_DIR, SYNC_STATE_DB)
+from .image_cache import ImageCache
+from .sync_state import SyncState
+
+
+def live_image_ids(manifest):
+    # Public ids of the images of every card published, and of the cards in the sync state (published
+    # before the manifest recorded them)
+    live = manifest.published()
+    if os.path.exists(SYNC_STATE_DB):
+        state = SyncState(SYNC_STATE_DB)
+        try:
+            live.update(image_ref(url) for url in state.card_images())
+        finally:
+            state.close()
+    return live
+
+
+def remove_path(path):
+    # Delete a file or a folder, True if it is gone
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print("Error deleting", path, e)
+        return False
+    return True
+
+
+def stale_entries(directory, cutoff, suffixes=None):
+    # Entries of a folder not modified since the cutoff, as absolute paths like the manifest
+    if not os.path.isdir(directory):
+        return []
+    paths = [os.path.abspath(os.path.join(directory, name)) for name in os.listdir(directory)
+             if suffixes is None or name.endswith(suffixes)]
+    return [path for path in paths if os.path.getmtime(path) < cutoff]
+
+
+def sweep_local(manifest, cutoff, dry_run):
+    # The files of the manifest, then what is left in the output folders (runs before the manifest
+    # existed, partial downloads) and the checkpoints of the old runs. Returns the files deleted.
+    tracked = manifest.pending("file", cutoff)
+    untracked = [path for path in stale_entries(EXPORTS_DIR, cutoff) + stale_entries(DOWNLOADS_DIR, cutoff)
+                 + stale_entries(IMAGES_DIR, cutoff, (".download", ".part")) + stale_entries(RUNS_DIR, cutoff)
+                 if path not in tracked]
+    if dry_run:
+        return len(tracked) + len(untracked)
+    removed = [path for path in tracked if remove_path(path)]
+    manifest.mark_deleted("file", removed)
+    return len(removed) + sum(remove_path(path) for path in untracked)
+
+
+@traced("collect_garbage")
+def collect_garbage(older_than_days, dry_run=False):
+    """
+    Delete the artifacts older than older_than_days, see the module docstring.
+    Returns the number of artifacts deleted (to delete with dry_run) by kind.
+    """
+    # Imported here, gc of local files only doesn't need the SDKs
+    from .backends.media import delete_cloudinary_images
+    from .backends.notion import archive_page
+
+    if not os.path.exists(STATE_DIR):
+        os.makedirs(STATE_DIR)
+    cutoff = time.time() - older_than_days * 24 * 3600
+    manifest = ArtifactManifest(ARTIFACTS_DB)
+    try:
+        live = live_image_ids(manifest)
+        images = [public_id for public_id in manifest.pending("cloudinary", cutoff) if public_id not in live]
+        pages = manifest.pending("notion_page", cutoff)
+        if dry_run:
+            return {"cloudinary": len(images), "notion_page": len(pages),
+                    "file": sweep_local(manifest, cutoff, dry_run)}
+
+        def archive(page_id):
+            archive_page(page_id)
+            return page_id
+
+        with TracedExecutor(max_workers=GC_WORKERS) as executor:
+            image_batches = [
+                executor.submit(delete_cloudinary_images, images[start:start + CLOUDINARY_DELETE_BATCH])
+                for start in range(0, len(images), CLOUDINARY_DELETE_BATCH)
+            ]
+            # The Notion client paces the archives with its rate limiter
+            archives = [executor.submit(archive, page_id) for page_id in pages]
+            # The local files are deleted while the API calls are in flight
+            files = sweep_local(manifest, cutoff, dry_run)
+
+            deleted_images = []
+            for batch in image_batches:
+                try:
+                    deleted_images.extend(batch.result())
+                except Exception as e:
+                    print("Error deleting images from Cloudinary:", e)
+            archived = []
+            for page_id, future in zip(pages, archives):
+                try:
+                    archived.append(future.result())
+                except Exception as e:
+                    print("Error archiving TempPage", page_id, e)
+
+        manifest.mark_deleted("cloudinary", deleted_images)
+        manifest.mark_deleted("notion_page", archived)
+        # The next run uploads the deleted images again instead of using their dead url
+        if os.path.exists(IMAGES_DIR):
+            image_cache = ImageCache(IMAGE_CACHE_DB, IMAGE_CACHE_MAX_BYTES)
+            try:
+                image_cache.forget(deleted_images)
+                image_cache.evict()
+            finally:
+                image_cache.close()
+        manifest.purge(cutoff)
+    finally:
+        manifest.close()
+
+    tracing.count("images_deleted", len(deleted_images))
+    tracing.count("pages_archived", len(archived))
+    tracing.count("files_deleted", files)
+    return {"cloudinary": len(deleted_images), "notion_page": len(archived), "file": files}
@@ -0,0 +1,208 @@
+"""
+Command line of Notion to Anki. A subcommand only loads the backends it uses.
+
+    python -m notion_to_anki run jobs.json                      sync every job of a job file
+    python -m notion_to_anki run --source ID --destination ID --deck NAME
+    python -m notion_to_anki run --resume RUN_ID                 continue a failed run from its checkpoints
+    python -m notion_to_anki fetch --source ID --destination ID --run run.json
+    python -m notion_to_anki format --run run.json              generate the cards with the LLM
+    python -m notion_to_anki publish --run run.json             append the cards to the destination page
+    python -m notion_to_anki import --run run.json              import the cards in Anki
+    python -m notion_to_anki watch jobs.json                    sync the jobs whenever their page is edited
+    python -m notion_to_anki gc --older-than 7                  delete what the runs of last week left behind
+
+fetch, format, publish and import are the stages of "run" one at a time, the run file carries the
+output of every stage to the next one.
+"""
+import argparse
+import sys
+
+from . import tracing
+from .config import (LLM_MODES, TRACES_DIR, WATCH_POLL_INTERVAL, WATCH_MAX_POLL_INTERVAL, WATCH_DEBOUNCE,
+                     GC_RETENTION_DAYS)
+
+
+EXPORT_MODES = ["direct", "native", "2anki"]
+COMMANDS = ["run", "fetch", "format", "publish", "import", "watch", "gc"]
+
+
+def job_from_args(args):
+    from .models import Job
+
+    if not args.source or not args.destination:
+        raise SystemExit("--source and --destination are required without a job file")
+    return Job(source=args.source, destination=args.destination, language=args.language, deck=args.deck,
+               export_mode=args.export_mode)
+
+
+def traced_command(func):
+    # Every command writes its own trace
+    def wrapper(args):
+        tracing.start_run(TRACES_DIR)
+        try:
+            return func(args)
+        finally:
+            print("Traza de la ejecución:", tracing.end_run())
+    return wrapper
+
+
+def command_run(args):
+    from .sync import load_jobs, sync_jobs, resume_jobs
+
+    # sync_jobs and resume_jobs write the trace themselves
+    if args.resume:
+        try:
+            finished, errors = resume_jobs(args.resume, args.full_sync, not args.no_llm_cache, args.llm_mode)
+        except FileNotFoundError as e:
+            raise SystemExit(str(e))
+        return 1 if errors else 0
+    if not args.jobs and not args.deck:
+        raise SystemExit(f"--deck is required, the {args.export_mode} export imports the cards in it")
+    try:
+        jobs = load_jobs(args.jobs) if args.jobs else [job_from_args(args)]
+    except ValueError as e:
+        raise SystemExit(str(e))
+    finished, errors = sync_jobs(jobs, args.full_sync, not args.no_llm_cache, args.llm_mode)
+    return 1 if errors else 0
+
+
+@traced_command
+def command_fetch(args):
+    from .sync import fetch_changes, process_changes, save_run
+
+    run = process_changes(fetch_changes(job_from_args(args), args.full_sync))
+    save_run(run, args.run)
+    print("Ejecución guardada en", args.run)
+    return 0
+
+
+@traced_command
+def command_format(args):
+    from .sync import load_run, format_changes, save_run
+
+    run = format_changes(load_run(args.run), not args.no_llm_cache, args.llm_mode)
+    save_run(run, args.run)
+    print(f"Tarjetas nuevas: {len(run['new_cards'].anki)}")
+    return 0
+
+
+@traced_command
+def command_publish(args):
+    from .sync import load_run, publish_changes, save_run
+
+    run = publish_changes(load_run(args.run))
+    save_run(run, args.run)
+    return 0
+
+
+@traced_command
+def command_import(args):
+    from .sync import load_run, import_changes, save_run
+
+    run = load_run(args.run)
+    # The deck and the export can be chosen at import time
+    if args.deck:
+        run["job"].deck = args.deck
+    if args.export_mode:
+        run["job"].export_mode = args.export_mode
+    if not run["job"].deck:
+        raise SystemExit("--deck is required, the run has no deck to import the cards in")
+    run = import_changes(run)
+    save_run(run, args.run)
+    return 0
+
+
+def command_watch(args):
+    from .watch import watch
+
+    try:
+        watch(args.jobs, args.interval, args.max_interval, args.debounce, not args.no_llm_cache, args.llm_mode,
+              args.once)
+    except KeyboardInterrupt:
+        print("Watch detenido")
+    return 0
+
+
+@traced_command
+def command_gc(args):
+    from .cleanup import collect_garbage
+
+    deleted = collect_garbage(args.older_than, args.dry_run)
+    verb = "Se eliminarían" if args.dry_run else "Eliminados"
+    print(f"{verb}: {deleted['cloudinary']} imágenes de Cloudinary, {deleted['notion_page']} TempPages de Notion, "
+          f"{deleted['file']} archivos locales")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="notion_to_anki", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_job_arguments(command):
+        command.add_argument("--source", help="id of the Notion page with the notes")
+        command.add_argument("--destination", help="id of the Notion page the cards are appended to")
+        command.add_argument("--language", default="es")
+        command.add_argument("--deck", help="Anki deck of the cards")
+        command.add_argument("--export-mode", choices=EXPORT_MODES, default="direct")
+
+    def add_llm_arguments(command):
+        command.add_argument("--llm-mode", choices=LLM_MODES, default="sync")
+        command.add_argument("--no-llm-cache", action="store_true", help="ignore the cached LLM responses")
+
+    run = commands.add_parser("run", help="sync jobs end to end")
+    run.add_argument("jobs", nargs="?", help="job file (JSON or YAML), or use --source and --destination")
+    add_job_arguments(run)
+    add_llm_arguments(run)
+    run.add_argument("--full-sync", action="store_true", help="handle every section, not only the changed ones")
+    run.add_argument("--resume", metavar="RUN_ID", help="continue a failed run, skipping the stages it finished")
+    run.set_defaults(func=command_run)
+
+    fetch = commands.add_parser("fetch", help="fetch the changed sections of a page and ingest their images")
+    add_job_arguments(fetch)
+    fetch.add_argument("--full-sync", action="store_true", help="handle every section, not only the changed ones")
+    fetch.add_argument("--run", required=True, help="run file to write")
+    fetch.set_defaults(func=command_fetch)
+
+    format_command = commands.add_parser("format", help="generate the cards of a fetched run")
+    format_command.add_argument("--run", required=True)
+    add_llm_arguments(format_command)
+    format_command.set_defaults(func=command_format)
+
+    publish = commands.add_parser("publish", help="append the cards of a run to its destination page")
+    publish.add_argument("--run", required=True)
+    publish.set_defaults(func=command_publish)
+
+    import_command = commands.add_parser("import", help="import the cards of a run in Anki")
+    import_command.add_argument("--run", required=True)
+    import_command.add_argument("--deck", help="override the deck of the run")
+    import_command.add_argument("--export-mode", choices=EXPORT_MODES, help="override the export of the run")
+    import_command.set_defaults(func=command_import)
+
+    watch_command = commands.add_parser("watch", help="poll Notion and sync the jobs whose source page was edited")
+    watch_command.add_argument("jobs", help="job file (JSON or YAML), read again on every poll")
+    watch_command.add_argument("--interval", type=float, default=WATCH_POLL_INTERVAL,
+                               help="seconds between polls while pages are changing")
+    watch_command.add_argument("--max-interval", type=float, default=WATCH_MAX_POLL_INTERVAL,
+                               help="seconds between polls once nothing changes")
+    watch_command.add_argument("--debounce", type=float, default=WATCH_DEBOUNCE,
+                               help="seconds a page must stay unedited before it is synced")
+    watch_command.add_argument("--once", action="store_true", help="poll a single time and exit")
+    add_llm_arguments(watch_command)
+    watch_command.set_defaults(func=command_watch)
+
+    gc = commands.add_parser("gc", help="delete the images, TempPages and files left by old runs")
+    gc.add_argument("--older-than", type=float, default=GC_RETENTION_DAYS, metavar="DAYS",
+                    help="only delete what was created at least this many days ago")
+    gc.add_argument("--dry-run", action="store_true", help="count what would be deleted without deleting it")
+    gc.set_defaults(func=command_gc)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
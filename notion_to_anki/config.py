@@ -0,0 +1,88 @@
+import os
+
+
+NOTION_BASE_URL = "https://api.notion.com/v1"
+
+# Maximum number of block children requests in flight while walking a page
+FETCH_WORKERS = 8
+# Maximum number of images being downloaded/uploaded at the same time
+IMAGE_WORKERS = 6
+# Lines of notes held back while the image before them is still being ingested
+NOTES_LOOKAHEAD = 256
+# Size of the chunks written to disk while downloading an image
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Local image store and the index of the images already posted to Cloudinary
+IMAGES_DIR = "images"
+IMAGE_CACHE_DB = os.path.join(IMAGES_DIR, "cache.sqlite")
+IMAGE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# Images are downscaled to this largest side and re-encoded ("WEBP" or "JPEG") before the upload,
+# in a process pool so the work uses every core
+IMAGE_MAX_SIZE = 1600
+IMAGE_FORMAT = "WEBP"
+IMAGE_QUALITY = 80
+IMAGE_PROCESSES = os.cpu_count() or 1
+# What was already synced from every source page, so a rerun only handles what changed
+STATE_DIR = "state"
+SYNC_STATE_DB = os.path.join(STATE_DIR, "sync.sqlite")
+# Progress of the block writes to Notion, to resume them after a failure
+WRITES_DIR = os.path.join(STATE_DIR, "writes")
+OPENAI_MODEL = "gpt-4o-2024-08-06"
+# Point it to a local server (e.g. a mock of the API) to run without the real one
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL")
+LLM_MODES = ["sync", "async", "batch", "stream"]
+# Every 2anki run downloads the Notion export and the deck to its own folder in here
+DOWNLOADS_DIR = "downloads"
+DOWNLOAD_TIMEOUT = 120
+# Workers of every stage of the multi job pipeline and size of the queues between them.
+# Only one export and one import at a time, Anki (and Chrome for 2anki) can't take more.
+PIPELINE_WORKERS = {"fetch": 2, "images": 2, "format": 3, "publish": 2, "export": 1, "import": 1}
+PIPELINE_QUEUE_SIZE = 2
+# Watch mode: where it remembers what it already synced, the seconds between polls (longer while
+# nothing changes) and how long a page must stay unedited before it is synced. Notion rounds
+# last_edited_time to the minute, a debounce of at least 60 seconds never misses a later edit.
+# A page whose sync failed is retried after WATCH_RETRY_INTERVAL seconds, doubled after every
+# failure up to WATCH_MAX_RETRY_INTERVAL.
+WATCH_STATE_PATH = os.path.join(STATE_DIR, "watch.json")
+WATCH_POLL_INTERVAL = 30
+WATCH_MAX_POLL_INTERVAL = 300
+WATCH_DEBOUNCE = 90
+WATCH_RETRY_INTERVAL = 60
+WATCH_MAX_RETRY_INTERVAL = 3600
+# Checkpoints of every run of the pipeline, a failed run is resumed from the stage that failed
+RUNS_DIR = os.path.join(STATE_DIR, "runs")
+# Artifacts created by the runs (Cloudinary images, TempPages, local files) for the gc command.
+# gc deletes what is older than the retention, the Cloudinary images in batches of 100 (the API limit).
+ARTIFACTS_DB = os.path.join(STATE_DIR, "artifacts.sqlite")
+GC_RETENTION_DAYS = 7
+GC_WORKERS = 4
+CLOUDINARY_DELETE_BATCH = 100
+# One JSON lines trace per run with the timings and counters of every stage
+TRACES_DIR = "traces"
+# Anki packages written by the native exporter
+EXPORTS_DIR = "exports"
+# Notes per addNotes action and addNotes actions per AnkiConnect "multi" request
+ANKI_NOTES_BATCH = 250
+ANKI_ACTIONS_PER_MULTI = 8
+BATCH_POLL_INTERVAL = 30
+# Token budget of the notes sent in a single prompt and maximum number of prompts in flight
+CHUNK_MAX_TOKENS = 6000
+LLM_WORKERS = 4
+# Parsed LLM responses, a rerun of unchanged notes doesn't call the API again
+LLM_CACHE_DB = os.path.join(STATE_DIR, "llm_cache.sqlite")
+# Cards already published per deck, to skip the exact and near duplicates
+CARD_INDEX_DB = os.path.join(STATE_DIR, "cards.sqlite")
+LLM_CACHE_MAX_BYTES = 64 * 1024 * 1024
+LLM_CACHE_MAX_AGE = 30 * 24 * 60 * 60
+
+
+def credential(name):
+    # Read when a backend first needs it, so a command only needs the keys of the services it uses.
+    # credentials.py is looked up first, then the environment.
+    try:
+        import credentials
+    except ImportError:
+        credentials = None
+    value = getattr(credentials, name, None) or os.environ.get(name)
+    if not value:
+        raise RuntimeError(f"Missing credential {name}, add it to credentials.py or to the environment")
+    return value
@@ -0,0 +1,79 @@
+import os
+import queue
+import time
+
+
+class DownloadWatcher:
+    """
+    Wait for the downloads of the current run in a directory that only this run uses.
+    With watchdog installed it is event driven (inotify on Linux, ReadDirectoryChangesW on Windows):
+    a file counts as downloaded when the browser renames its temporary file (.crdownload) to the final name.
+    Without watchdog the directory is polled.
+
+        with DownloadWatcher(directory, ".zip") as watcher:
+            # start the download
+            path = watcher.wait(60)
+    """
+
+    def __init__(self, directory, extension, poll_interval=0.2):
+        self.directory = directory
+        self.extension = extension
+        self.poll_interval = poll_interval
+        self.files = queue.Queue()
+        self.seen = set()
+        self.observer = None
+
+    def __enter__(self):
+        # Files already there are never reported, only the ones that appear from now on
+        self.seen = set(os.listdir(self.directory))
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            return self
+
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_created(self, event):
+                if not event.is_directory:
+                    watcher.found(event.src_path)
+
+            def on_moved(self, event):
+                if not event.is_directory:
+                    watcher.found(event.dest_path)
+
+        self.observer = Observer()
+        self.observer.schedule(Handler(), self.directory, recursive=False)
+        self.observer.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+
+    def found(self, path):
+        if path.endswith(self.extension):
+            self.files.put(os.path.abspath(path))
+
+    def poll(self):
+        for file_name in os.listdir(self.directory):
+            if file_name not in self.seen:
+                self.seen.add(file_name)
+                self.found(os.path.join(self.directory, file_name))
+
+    def wait(self, timeout):
+        # Returns the path of the next downloaded file, raises TimeoutError if there is none in time
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"No {self.extension} file downloaded to {self.directory} in {timeout} seconds")
+            if self.observer is None:
+                self.poll()
+                remaining = min(remaining, self.poll_interval)
+            try:
+                return self.files.get(timeout=remaining)
+            except queue.Empty:
+                continue
@@ -0,0 +1,121 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+class ImageCache:
+    """
+    Persistent index of the images already posted to Cloudinary, keyed by the sha256 of their content.
+    It also remembers which content each Notion image block had at a given last_edited_time, so an
+    unchanged block is not even downloaded again. The local copies are evicted by size, least recently used first.
+    """
+
+    def __init__(self, db_path, max_bytes):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS images (
+                    hash TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    path TEXT,
+                    size INTEGER NOT NULL DEFAULT 0,
+                    last_used REAL NOT NULL
+                )""")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS blocks (
+                    block_id TEXT PRIMARY KEY,
+                    last_edited_time TEXT NOT NULL,
+                    hash TEXT NOT NULL
+                )""")
+
+    def get(self, content_hash):
+        # Cloudinary url of an image content, None if it was never uploaded
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT url FROM images WHERE hash = ?", (content_hash,)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute("UPDATE images SET last_used = ? WHERE hash = ?", (time.time(), content_hash))
+            return row[0]
+
+    def path_for_url(self, url):
+        # Local copy of an uploaded image, None if it was evicted or never stored
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT path FROM images WHERE url = ? AND path IS NOT NULL", (url,)
+            ).fetchone()
+        if row and os.path.exists(row[0]):
+            return row[0]
+        return None
+
+    def get_block(self, block_id, last_edited_time):
+        # Content hash of an image block if it didn't change since it was seen
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT hash FROM blocks WHERE block_id = ? AND last_edited_time = ?",
+                (block_id, last_edited_time)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, content_hash, url, path):
+        size = os.path.getsize(path) if path and os.path.exists(path) else 0
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO images (hash, url, path, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                (content_hash, url, path, size, time.time())
+            )
+
+    def touch_path(self, content_hash, path):
+        # A known image was downloaded again, track the new local copy
+        size = os.path.getsize(path)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE images SET path = ?, size = ?, last_used = ? WHERE hash = ?",
+                (path, size, time.time(), content_hash)
+            )
+
+    def put_block(self, block_id, last_edited_time, content_hash):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO blocks (block_id, last_edited_time, hash) VALUES (?, ?, ?)",
+                (block_id, last_edited_time, content_hash)
+            )
+
+    def evict(self):
+        # Delete the least recently used local copies until the store fits in max_bytes.
+        # The hash -> url mapping is kept, only the file goes away.
+        with self.lock, self.connection:
+            rows = self.connection.execute(
+                "SELECT hash, path, size FROM images WHERE path IS NOT NULL ORDER BY last_used DESC"
+            ).fetchall()
+            total = 0
+            evicted = 0
+            for content_hash, path, size in rows:
+                total += size
+                if total <= self.max_bytes:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                self.connection.execute("UPDATE images SET path = NULL, size = 0 WHERE hash = ?", (content_hash,))
+                evicted += 1
+        return evicted
+
+    def forget(self, content_hashes):
+        # The images were deleted from Cloudinary, the next run uploads them again
+        with self.lock, self.connection:
+            for content_hash in content_hashes:
+                row = self.connection.execute("SELECT path FROM images WHERE hash = ?", (content_hash,)).fetchone()
+                if row and row[0]:
+                    try:
+                        os.remove(row[0])
+                    except FileNotFoundError:
+                        pass
+                self.connection.execute("DELETE FROM images WHERE hash = ?", (content_hash,))
+                self.connection.execute("DELETE FROM blocks WHERE hash = ?", (content_hash,))
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,62 @@
+import os
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+
+EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp", "GIF": ".gif", "BMP": ".bmp", "TIFF": ".tiff"}
+
+
+def detect_format(path):
+    # Real format of an image from its content, None if PIL can't read it (e.g. SVG)
+    try:
+        with Image.open(path) as image:
+            return image.format
+    except (UnidentifiedImageError, OSError):
+        return None
+
+
+def extension_for(image_format):
+    return EXTENSIONS.get(image_format, f".{image_format.lower()}" if image_format else ".bin")
+
+
+def optimize_image(source_path, output_base, max_size, output_format, quality):
+    """
+    Downscale an image so its largest side is at most max_size and re-encode it as WEBP or JPEG.
+    Runs in a worker process, so it only takes and returns plain values.
+    The original is kept (renamed with the extension of its real format) when it can't be read, is
+    animated, or the optimized version is not smaller. The source file is always consumed.
+    Returns (path, original_size, optimized_size).
+    """
+    original_size = os.path.getsize(source_path)
+    try:
+        with Image.open(source_path) as image:
+            source_format = image.format
+            if getattr(image, "is_animated", False):
+                raise ValueError("animated images are kept as they are")
+            image = ImageOps.exif_transpose(image)
+            downscaled = max(image.size) > max_size
+            image.thumbnail((max_size, max_size), Image.LANCZOS)
+            has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+            target_format = output_format
+            if target_format == "JPEG" and has_alpha:
+                # JPEG has no transparency, WEBP keeps it
+                target_format = "WEBP"
+            image = image.convert("RGBA" if has_alpha else "RGB")
+            optimized_path = output_base + extension_for(target_format)
+            temp_path = optimized_path + ".part"
+            save_options = {"quality": quality, "optimize": True} if target_format == "JPEG" else {"quality": quality}
+            image.save(temp_path, target_format, **save_options)
+    except (UnidentifiedImageError, OSError, ValueError):
+        path = output_base + extension_for(detect_format(source_path))
+        os.replace(source_path, path)
+        return path, original_size, original_size
+
+    optimized_size = os.path.getsize(temp_path)
+    if optimized_size >= original_size and not downscaled:
+        os.remove(temp_path)
+        path = output_base + extension_for(source_format)
+        os.replace(source_path, path)
+        return path, original_size, original_size
+    os.replace(temp_path, optimized_path)
+    os.remove(source_path)
+    return optimized_path, original_size, optimized_size
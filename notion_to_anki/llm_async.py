@@ -0,0 +1,181 @@
+import asyncio
+import json
+import time
+
+from .prompts import build_messages
+
+
+# Batch states after which there is nothing else to wait for
+BATCH_FINAL_STATUSES = ["completed", "failed", "expired", "cancelled"]
+
+
+async def format_chunks_async(client, chunks, language, model, response_format, max_concurrency, usage=None,
+                              on_result=None):
+    """
+    Format every chunk with a single AsyncOpenAI client, at most max_concurrency requests in flight.
+    Returns the parsed responses in the order of the chunks. on_result(index, result) is called as
+    soon as a chunk is done, a failed chunk doesn't stop the others and the first error is raised
+    once all of them finished. language can be a list with the language of each chunk.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    languages = [language] * len(chunks) if isinstance(language, str) else language
+
+    async def format_one(index, notes, language):
+        async with semaphore:
+            completion = await client.beta.chat.completions.parse(
+                model=model,
+                messages=build_messages(notes, language),
+                response_format=response_format,
+            )
+        if usage is not None:
+            usage.add(completion.usage)
+        result = completion.choices[0].message.parsed
+        if on_result is not None:
+            on_result(index, result)
+        return result
+
+    results = await asyncio.gather(*(format_one(index, notes, language)
+                                     for index, (notes, language) in enumerate(zip(chunks, languages))),
+                                   return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+def strict_json_schema(schema):
+    # Structured outputs in strict mode need every object closed and every property required
+    if isinstance(schema, dict):
+        if schema.get("type") == "object":
+            schema["additionalProperties"] = False
+            schema["required"] = list(schema.get("properties", {}))
+        for value in schema.values():
+            strict_json_schema(value)
+    elif isinstance(schema, list):
+        for value in schema:
+            strict_json_schema(value)
+    return schema
+
+
+def response_format_param(response_format):
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": response_format.__name__,
+            "schema": strict_json_schema(response_format.model_json_schema()),
+            "strict": True
+        }
+    }
+
+
+def build_batch_file(chunks, language, model, response_format):
+    # language is the language of every chunk, or a list with the language of each one
+    languages = [language] * len(chunks) if isinstance(language, str) else language
+    lines = []
+    for index, (notes, language) in enumerate(zip(chunks, languages)):
+        lines.append(json.dumps({
+            "custom_id": f"chunk-{index}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": model,
+                "messages": build_messages(notes, language),
+                "response_format": response_format_param(response_format)
+            }
+        }))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def format_chunks_batch(client, chunks, language, model, response_format, poll_interval=30, timeout=24 * 60 * 60,
+                        usage=None, on_result=None):
+    """
+    Submit all the chunks as a single Batch job, wait for it and fan the results back out in the
+    order of the chunks. Meant for runs that are not urgent, the batch can take up to 24 hours.
+    language can be a list with the language of each chunk, the chunks of several jobs go together.
+    on_result(index, result) is called for every chunk that succeeded, even when others failed.
+    """
+    from openai.types import CompletionUsage
+
+    batch_file = client.files.create(
+        file=("batch.jsonl", build_batch_file(chunks, language, model, response_format)),
+        purpose="batch"
+    )
+    batch = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+    print(f"Batch {batch.id} enviado con {len(chunks)} fragmentos")
+
+    started = time.monotonic()
+    while batch.status not in BATCH_FINAL_STATUSES:
+        if time.monotonic() - started > timeout:
+            raise TimeoutError(f"Batch {batch.id} not finished after {timeout} seconds")
+        time.sleep(poll_interval)
+        batch = client.batches.retrieve(batch.id)
+    if batch.status != "completed" or batch.output_file_id is None:
+        raise RuntimeError(f"Batch {batch.id} ended with status {batch.status}")
+
+    results = [None] * len(chunks)
+    output = client.files.content(batch.output_file_id).text
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        index = int(result["custom_id"].split("-")[-1])
+        response = result.get("response") or {}
+        if response.get("status_code") != 200:
+            print(f"Error in batch request {result['custom_id']}:", result.get("error") or response.get("body"))
+            continue
+        body = response["body"]
+        if usage is not None and body.get("usage"):
+            usage.add(CompletionUsage.model_validate(body["usage"]))
+        results[index] = response_format.model_validate_json(body["choices"][0]["message"]["content"])
+        if on_result is not None:
+            on_result(index, results[index])
+
+    failed = [index for index, result in enumerate(results) if result is None]
+    if failed:
+        raise RuntimeError(f"Batch {batch.id} has no result for chunks {failed}")
+    return results
+
+
+class ObjectStreamParser:
+    """
+    Incremental parser for a JSON document that arrives in pieces. It returns every object nested at
+    the given depth as soon as it is complete, e.g. depth 2 gives each card of {"anki": [{...}, {...}]}
+    while the rest of the document is still being generated.
+    """
+
+    def __init__(self, depth=2):
+        self.depth = depth
+        self.level = 0
+        self.in_string = False
+        self.escaped = False
+        self.current = []
+
+    def feed(self, text):
+        objects = []
+        for char in text:
+            if self.level >= self.depth:
+                self.current.append(char)
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                continue
+            if char == '"':
+                self.in_string = True
+            elif char == "{":
+                self.level += 1
+                if self.level == self.depth:
+                    self.current = [char]
+            elif char == "}":
+                if self.level == self.depth:
+                    objects.append(json.loads("".join(self.current)))
+                    self.current = []
+                self.level -= 1
+        return objects
@@ -0,0 +1,68 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+class LLMCache:
+    """
+    On disk cache of the parsed LLM responses. Entries older than max_age seconds are dropped and
+    the least recently used ones are evicted once the cache is bigger than max_bytes.
+    """
+
+    def __init__(self, db_path, max_bytes, max_age):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )""")
+
+    @staticmethod
+    def make_key(prompt_version, model, language, notes):
+        notes_hash = hashlib.sha256(notes.encode("utf-8")).hexdigest()
+        data = json.dumps([prompt_version, model, language, notes_hash])
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        # Returns the cached JSON or None
+        now = time.time()
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT value FROM responses WHERE key = ? AND created >= ?", (key, now - self.max_age)
+            ).fetchone()
+            if row is None:
+                return None
+            self.connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def put(self, key, value):
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), now, now)
+            )
+
+    def evict(self):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.max_age,))
+            rows = self.connection.execute("SELECT key, size FROM responses ORDER BY last_used DESC").fetchall()
+            total = 0
+            expired = []
+            for key, size in rows:
+                total += size
+                if total > self.max_bytes:
+                    expired.append((key,))
+            self.connection.executemany("DELETE FROM responses WHERE key = ?", expired)
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,22 @@
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class Card(BaseModel):
+        question: str
+        answer: str
+        image: Optional[str]
+
+class Anki(BaseModel):
+        anki: list[Card]
+
+class Job(BaseModel):
+        # One source page synced to one destination page and one deck
+        source: str
+        destination: str
+        language: str = "es"
+        deck: Optional[str] = None
+        # "direct" adds the notes with AnkiConnect, "native" writes the .apkg locally and imports it,
+        # "2anki" exports the TempPage with Chrome and converts it in 2anki.net
+        export_mode: str = "direct"
@@ -0,0 +1,139 @@
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from . import tracing
+
+
+# Notion allows an average of 3 requests per second per integration
+NOTION_RATE_LIMIT = 3
+NOTION_BURST = 3
+# Status codes worth retrying: rate limited, conflicts and transient server errors
+RETRY_STATUS_CODES = [409, 429, 500, 502, 503, 504]
+# Requests that can be sent twice with the same result, the others (creating a page, appending
+# blocks) are only retried when Notion didn't apply them: rate limited, conflict or never sent
+IDEMPOTENT_METHODS = ["GET", "HEAD", "OPTIONS", "PUT", "DELETE"]
+NOT_APPLIED_STATUS_CODES = [409, 429]
+
+
+def never_sent(error):
+    # The connection could not be made (refused, unknown host, connect timeout), a connection lost or
+    # a read timeout may come after Notion received the request
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+class TokenBucket:
+    """Thread safe token bucket, acquire() blocks until a token is available."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        # Empty the bucket so every thread waits after a 429
+        with self.lock:
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+            self.updated = time.monotonic()
+
+
+class NotionClient:
+    """
+    Shared client for the Notion API.
+    Keeps the connections alive in a pool, paces the requests with a token bucket and
+    retries rate limited or failed requests honoring Retry-After with exponential backoff.
+    A request that is not idempotent is only retried when it certainly wasn't applied, so a timeout
+    doesn't create a page or append blocks twice. idempotent=True retries it like a GET (a search,
+    setting a property).
+    """
+
+    def __init__(self, api_key, base_url, version="2022-06-28", rate=NOTION_RATE_LIMIT, burst=NOTION_BURST,
+                 max_retries=5, backoff=0.5, pool_size=16, timeout=30):
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate, burst)
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+            "Notion-Version": version
+        })
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method, path, idempotent=None, **kwargs):
+        url = path if path.startswith("http") else f"{self.base_url}{path}"
+        kwargs.setdefault("timeout", self.timeout)
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        retry_status_codes = RETRY_STATUS_CODES if idempotent else NOT_APPLIED_STATUS_CODES
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                tracing.count("http_connection_errors")
+                if attempt == self.max_retries or not (idempotent or never_sent(e)):
+                    raise
+                tracing.count("http_retries")
+                time.sleep(self.backoff_delay(attempt))
+                continue
+            tracing.count(f"http_{response.status_code}")
+            tracing.count("bytes_notion", len(response.content))
+            if response.status_code not in retry_status_codes or attempt == self.max_retries:
+                response.raise_for_status()
+                return response
+            delay = self.retry_after(response)
+            if delay is None:
+                delay = self.backoff_delay(attempt)
+            if response.status_code == 429:
+                self.bucket.pause(delay)
+            tracing.count("http_retries")
+            time.sleep(delay)
+
+    def backoff_delay(self, attempt):
+        # Exponential backoff with jitter so the threads don't retry at the same time
+        return self.backoff * 2 ** attempt * (1 + random.random())
+
+    @staticmethod
+    def retry_after(response):
+        try:
+            return float(response.headers["Retry-After"])
+        except (KeyError, ValueError):
+            return None
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.request("PATCH", path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request("DELETE", path, **kwargs)
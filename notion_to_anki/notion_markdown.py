@@ -0,0 +1,110 @@
+"""
+Notion blocks to compact Markdown, one line at a time. The converter only keeps the numbering of
+the numbered lists that are open, so a page of any size is converted with the same memory and the
+first lines are ready before the rest of the page has been fetched.
+"""
+from itertools import groupby
+
+
+# Markdown of a rich text annotation, code is applied alone (nothing is formatted inside a code span)
+ANNOTATION_MARKERS = [("bold", "**"), ("italic", "*"), ("strikethrough", "~~")]
+# Blocks with rich text and the prefix of their line
+TEXT_PREFIXES = {
+    "paragraph": "", "heading_1": "# ", "heading_2": "## ", "heading_3": "### ", "quote": "> ",
+    "callout": "> ", "bulleted_list_item": "- ", "toggle": "- ",
+}
+LINK_BLOCK_TYPES = ["bookmark", "embed", "link_preview", "video", "file", "pdf", "audio"]
+# Blocks without text of their own, their children still come in the stream
+IGNORED_BLOCK_TYPES = ["divider", "table_of_contents", "breadcrumb", "column_list", "column", "table",
+                       "synced_block", "child_database", "unsupported"]
+INDENT = "  "
+
+
+def segment_style(segment):
+    annotations = segment.get("annotations") or {}
+    return (segment.get("type", "text"), segment.get("href"), bool(annotations.get("code")),
+            tuple(bool(annotations.get(name)) for name, marker in ANNOTATION_MARKERS))
+
+
+def rich_text_to_markdown(rich_text):
+    # Every segment of the rich text, the consecutive segments with the same style are joined first
+    # so a sentence split by Notion doesn't come out as **a****b**
+    parts = []
+    for (segment_type, href, code, styles), segments in groupby(rich_text, key=segment_style):
+        if segment_type == "equation":
+            parts.extend(f"${segment['equation']['expression']}$" for segment in segments)
+            continue
+        text = "".join(segment["plain_text"] for segment in segments)
+        core = text.strip()
+        if not core:
+            parts.append(text)
+            continue
+        if code:
+            core = f"`{core}`"
+        else:
+            for (name, marker), applied in zip(ANNOTATION_MARKERS, styles):
+                if applied:
+                    core = marker + core + marker
+        if href:
+            core = f"[{core}]({href})"
+        # Markers around spaces are not Markdown, the spaces stay outside
+        parts.append(text[:len(text) - len(text.lstrip())] + core + text[len(text.rstrip()):])
+    return "".join(parts).replace("\n", " ")
+
+
+def iter_markdown(blocks, render_image=None):
+    """
+    Yield the Markdown lines of a (block, depth) stream, children indented by their depth.
+    render_image(block, indent) gives the line of an image block (anything, it is yielded as is),
+    without it the images are skipped.
+    """
+    # Next number of the numbered list open at every depth
+    numbers = []
+    for block, depth in blocks:
+        block_type = block["type"]
+        # The lists deeper than this block ended, a numbered list restarts after any other block
+        del numbers[depth + 1:]
+        numbers.extend([0] * (depth + 1 - len(numbers)))
+        if block_type == "numbered_list_item":
+            numbers[depth] += 1
+        else:
+            numbers[depth] = 0
+        indent = INDENT * depth
+        try:
+            content = block[block_type] if block_type in block else {}
+            if block_type in TEXT_PREFIXES or block_type in ("numbered_list_item", "to_do"):
+                text = rich_text_to_markdown(content["rich_text"])
+                if not text.strip():
+                    continue
+                if block_type == "numbered_list_item":
+                    prefix = f"{numbers[depth]}. "
+                elif block_type == "to_do":
+                    prefix = "- [x] " if content.get("checked") else "- [ ] "
+                else:
+                    prefix = TEXT_PREFIXES[block_type]
+                yield indent + prefix + text
+            elif block_type == "code":
+                language = content.get("language", "")
+                yield indent + "```" + ("" if language == "plain text" else language)
+                for line in "".join(segment["plain_text"] for segment in content["rich_text"]).split("\n"):
+                    yield indent + line
+                yield indent + "```"
+            elif block_type == "equation":
+                yield indent + f"$${content['expression']}$$"
+            elif block_type == "table_row":
+                yield indent + "| " + " | ".join(rich_text_to_markdown(cell) for cell in content["cells"]) + " |"
+            elif block_type == "child_page":
+                yield indent + content["title"]
+            elif block_type in LINK_BLOCK_TYPES:
+                url = content["url"] if "url" in content else content[content["type"]]["url"]
+                caption = rich_text_to_markdown(content.get("caption", []))
+                yield indent + (f"[{caption}]({url})" if caption else url)
+            elif block_type == "image":
+                if render_image is not None:
+                    yield render_image(block, indent)
+            elif block_type in IGNORED_BLOCK_TYPES:
+                pass
+            else:
+                print("Block type not supported", block_type)
+        except Exception as e:
+            print("Error processing block:", block, e)
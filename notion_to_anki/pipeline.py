@@ -0,0 +1,82 @@
+import queue
+import threading
+
+
+# Put in a queue to tell the workers of a stage there is nothing else coming
+_DONE = object()
+
+
+class Stage:
+    """
+    A step of the pipeline: func(item) returns the item for the next stage, or None to drop it.
+    workers threads run the stage at the same time.
+    """
+
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = workers
+
+
+def run_pipeline(items, stages, queue_size=2):
+    """
+    Run every item through the stages in order. Each stage has its own workers and a bounded queue in
+    front of it, so different items are in different stages at the same time and a slow stage holds
+    back the ones before it instead of piling items up in memory.
+    Returns the items that went through every stage and the errors as (item, stage name, exception).
+    An item that fails in a stage doesn't go to the next ones, the rest keep going.
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    finished = []
+    errors = []
+    lock = threading.Lock()
+
+    def work(index):
+        stage = stages[index]
+        while True:
+            item = queues[index].get()
+            if item is _DONE:
+                return
+            try:
+                result = stage.func(item)
+            except BaseException as e:
+                # SystemExit too: a worker that dies leaves the queues full and the pipeline hangs
+                print(f"Error in stage {stage.name}:", e)
+                with lock:
+                    errors.append((item, stage.name, e))
+                continue
+            if result is None:
+                continue
+            if index + 1 < len(stages):
+                queues[index + 1].put(result)
+            else:
+                with lock:
+                    finished.append(result)
+
+    def feed():
+        for item in items:
+            queues[0].put(item)
+        for _ in range(stages[0].workers):
+            queues[0].put(_DONE)
+
+    threads = []
+    for index, stage in enumerate(stages):
+        stage_threads = [
+            threading.Thread(target=work, args=(index,), name=f"{stage.name}-{n}", daemon=True)
+            for n in range(stage.workers)
+        ]
+        for thread in stage_threads:
+            thread.start()
+        threads.append(stage_threads)
+    feeder = threading.Thread(target=feed, name="feed", daemon=True)
+    feeder.start()
+
+    # A stage is over when all its workers are, then the next one is told to finish
+    feeder.join()
+    for index, stage_threads in enumerate(threads):
+        for thread in stage_threads:
+            thread.join()
+        if index + 1 < len(stages):
+            for _ in range(stages[index + 1].workers):
+                queues[index + 1].put(_DONE)
+    return finished, errors
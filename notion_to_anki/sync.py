@@ -0,0 +1,473 @@
+import json
+import os
+import queue
+import threading
+import time
+
+from . import artifacts, tracing
+from .block_writer import BlockWriter, WriteJournal, MAX_CHILDREN_PER_REQUEST
+from .card_index import CardIndex, DuplicateFilter, card_entry
+from .config import (STATE_DIR, SYNC_STATE_DB, WRITES_DIR, CARD_INDEX_DB, TRACES_DIR, RUNS_DIR, PIPELINE_WORKERS,
+                     PIPELINE_QUEUE_SIZE)
+from .models import Anki, Job
+from .pipeline import Stage, run_pipeline
+from .sync_state import SyncState, iter_sections, section_fingerprint
+from .backends.notion import get_notion, get_notion_page_content, card_to_toggle, update_notion_page
+from .backends.llm import format_sections, format_jobs, normalize_question, JOBS_MODES
+from .backends.media import process_raw_notion_pages, shutdown_image_pool
+from .backends.export import notion_to_2anki, export_apkg, clean_files
+from .backends.anki import get_anki, anki_to_anki_connect, import_anki_package, two_anki_to_anki_connect
+
+
+class StreamingPublisher:
+    """
+    Publish the cards while the LLM is still generating them. A thread appends the cards that arrive
+    to the destination page, every card that is waiting goes in the same request, and adds them to
+    the Anki deck when a deck is given (direct export).
+    Every batch published is added to the card index of scope right away and passed to on_published,
+    so a run that fails later never publishes those cards again.
+    put() can be called from any thread, close() waits for the cards left and raises the first error.
+    """
+
+    def __init__(self, page_id, deck=None, scope=None, on_published=None):
+        self.page_id = page_id
+        self.deck = deck
+        self.scope = scope or deck or page_id
+        self.on_published = on_published
+        self.cards = queue.Queue()
+        self.published = []
+        self.error = None
+        self.started = time.perf_counter()
+        self.writer = BlockWriter(get_notion(), WriteJournal(WRITES_DIR))
+        self.thread = threading.Thread(target=self.run, name="stream-publisher", daemon=True)
+        self.thread.start()
+
+    def put(self, card):
+        self.cards.put(card)
+
+    def next_batch(self):
+        # Blocks for the first card, then takes every card already waiting. None marks the end.
+        batch = [self.cards.get()]
+        while batch[-1] is not None and len(batch) < MAX_CHILDREN_PER_REQUEST:
+            try:
+                batch.append(self.cards.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        with tracing.span("stream_publish", page_id=self.page_id) as span:
+            while True:
+                batch = self.next_batch()
+                done = batch[-1] is None
+                cards = [card for card in batch if card is not None]
+                if cards and self.error is None:
+                    if not self.published:
+                        span["attributes"]["first_card_seconds"] = time.perf_counter() - self.started
+                        print(f"Primera tarjeta publicada en {time.perf_counter() - self.started:.2f}s")
+                    try:
+                        artifacts.record_published(cards)
+                        self.writer.append(self.page_id, [card_to_toggle(card) for card in cards])
+                        if self.deck is not None:
+                            anki_to_anki_connect(Anki(anki=cards), self.deck)
+                        self.published.extend(cards)
+                        tracing.count("cards_streamed", len(cards))
+                        self.record(cards)
+                    except Exception as e:
+                        # The cards that keep arriving are dropped, close() reports the error
+                        self.error = e
+                if done:
+                    return
+
+    def record(self, cards):
+        index = CardIndex(CARD_INDEX_DB)
+        try:
+            index.add_many(self.scope, [card_entry(card.question, card.answer) for card in cards])
+        finally:
+            index.close()
+        if self.on_published is not None:
+            self.on_published(cards)
+
+    def close(self):
+        self.cards.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.published
+
+# Stages of a sync, every one takes the run dict of the previous one and returns it with its output
+
+def fetch_changes(job, full_sync=False):
+    # Walk the source page and keep the sections that changed since the last sync
+    if not os.path.exists(STATE_DIR):
+        os.makedirs(STATE_DIR)
+    sync_id = f"{job.source}:{job.destination}:{job.language}"
+    state = SyncState(SYNC_STATE_DB)
+    section_ids = []
+    changed_sections = []
+    try:
+        # stream of blocks, consumed while the rest of the page is still being fetched
+        for section_id, blocks in iter_sections(get_notion_page_content(job.source)):
+            section_ids.append(section_id)
+            if not full_sync and state.fingerprint(sync_id, section_id) == section_fingerprint(blocks):
+                continue
+            changed_sections.append((section_id, blocks))
+    finally:
+        state.close()
+    print(f"Secciones cambiadas: {len(changed_sections)} de {len(section_ids)}")
+    return {"job": job, "sync_id": sync_id, "section_ids": section_ids, "changed_sections": changed_sections}
+
+def process_changes(run):
+    # extract only the text content from the changed sections, the images go to Cloudinary.
+    # All the sections at once, so the images of different sections are ingested at the same time.
+    run["notes"] = process_raw_notion_pages([blocks for section_id, blocks in run["changed_sections"]])
+    return run
+
+def card_index_scope(job):
+    # The index is per deck, or per destination page when the job has no deck
+    return job.deck or job.destination
+
+def open_duplicate_filter(job):
+    index = CardIndex(CARD_INDEX_DB)
+    if job.deck:
+        try:
+            seeded = index.seed(job.deck, get_anki())
+            if seeded:
+                print(f"Índice de tarjetas: {seeded} notas de {job.deck} añadidas desde Anki")
+        except Exception as e:
+            print("Error seeding the card index from Anki:", e)
+    return DuplicateFilter(index, card_index_scope(job))
+
+def format_changes(run, use_llm_cache=True, llm_mode="sync", prefetched=None, checkpoint=None):
+    # return a JSON object with the structure of the Anki object for every changed section,
+    # prefetched are the responses of format_jobs. checkpoint(run) saves the run while the
+    # cards are streamed, with the ones already published in run["streamed_cards"].
+    job = run["job"]
+    if not os.path.exists(STATE_DIR):
+        os.makedirs(STATE_DIR)
+    duplicates = open_duplicate_filter(job)
+    kept = set()
+    run.setdefault("streamed_cards", [])
+    # Published by the stream of a run that failed afterwards, they are in the card index already
+    streamed = {normalize_question(card["question"]) for card in run["streamed_cards"]}
+
+    def keep_card(card):
+        # Cards already in the deck (or near duplicates of them) are never written anywhere.
+        # Returns True when the card has to be published.
+        if normalize_question(card.question) in streamed:
+            kept.add(id(card))
+            return False
+        if duplicates.keep(card.question, card.answer):
+            kept.add(id(card))
+            return True
+        return False
+
+    def on_published(cards):
+        # Called from the publisher thread, the format stage doesn't touch the run until it is closed
+        run["streamed_cards"].extend(card.model_dump() for card in cards)
+        if checkpoint is not None:
+            checkpoint(run)
+
+    publisher = None
+    on_card = None
+    if llm_mode == "stream":
+        # The cards are published while they are generated, publish and import only do what is left
+        publisher = StreamingPublisher(job.destination, job.deck if job.export_mode == "direct" else None,
+                                       card_index_scope(job), on_published)
+        on_card = lambda card: keep_card(card) and publisher.put(card)
+    try:
+        formatted_sections = format_sections(run["notes"], job.language, use_cache=use_llm_cache, mode=llm_mode,
+                                             on_card=on_card, prefetched=prefetched)
+        if publisher is None:
+            for formatted_content in formatted_sections:
+                for card in formatted_content.anki:
+                    keep_card(card)
+    finally:
+        if publisher is not None:
+            publisher.close()
+        duplicates.index.close()
+    run["formatted_sections"] = [Anki(anki=[card for card in formatted_content.anki if id(card) in kept])
+                                 for formatted_content in formatted_sections]
+    if duplicates.dropped:
+        print(f"Tarjetas repetidas descartadas: {duplicates.dropped}")
+    tracing.count("cards_duplicated", duplicates.dropped)
+    run["streamed_to_notion"] = publisher is not None
+    run["streamed_to_anki"] = publisher is not None and publisher.deck is not None
+    run["new_cards"] = Anki(anki=[card for formatted_content in run["formatted_sections"]
+                                  for card in formatted_content.anki])
+    return run
+
+def publish_changes(run):
+    job = run["job"]
+    run["temp_page_url"] = None
+    create_temp_page = job.export_mode == "2anki"
+    # Recorded before the write, an image linked from Notion or Anki is never garbage collected
+    artifacts.record_published(run["new_cards"].anki)
+    if run["new_cards"].anki and (create_temp_page or not run.get("streamed_to_notion")):
+        # Updated Notion page (appends the new content)
+        run["temp_page_url"] = update_notion_page(job.destination, run["new_cards"], create_temp_page,
+                                                  not run.get("streamed_to_notion"))
+
+    # The published cards count as known from now on
+    index = CardIndex(CARD_INDEX_DB)
+    try:
+        index.add_many(card_index_scope(job),
+                       [card_entry(card.question, card.answer) for card in run["new_cards"].anki])
+    finally:
+        index.close()
+
+    # The state is saved once the cards are in Notion, a failed push is retried on the next run
+    state = SyncState(SYNC_STATE_DB)
+    try:
+        for (section_id, blocks), formatted_content in zip(run["changed_sections"], run["formatted_sections"]):
+            state.save_section(run["sync_id"], section_id, blocks,
+                               [card.model_dump() for card in formatted_content.anki])
+        state.prune(run["sync_id"], run["section_ids"])
+    finally:
+        state.close()
+    return run
+
+def export_changes(run):
+    # Write the deck file of the export mode, kept in the run so a failed import doesn't export again
+    job = run["job"]
+    run["zip_path"], run["deck_path"] = None, None
+    if not run["new_cards"].anki or run.get("streamed_to_anki"):
+        return run
+    run["zip_path"], run["deck_path"] = export_deck(run["temp_page_url"], run["new_cards"], job.deck,
+                                                    job.export_mode)
+    return run
+
+def import_changes(run):
+    # Import the new cards in the deck of the job and delete the remanent files
+    job = run["job"]
+    if not run["new_cards"].anki:
+        print("No hay tarjetas nuevas que importar")
+        return run
+    if run.get("streamed_to_anki"):
+        print("Las tarjetas ya se añadieron a Anki mientras se generaban")
+        return run
+    if "deck_path" not in run:
+        run = export_changes(run)
+    import_deck(run["deck_path"], run["new_cards"], job.deck, job.export_mode)
+    clean_files(run["temp_page_url"], run["deck_path"], run["zip_path"])
+    return run
+
+def save_run(run, path):
+    # Write the run dict as JSON, atomically, so another command (or process) can continue it
+    data = dict(run)
+    data["job"] = run["job"].model_dump()
+    if "formatted_sections" in data:
+        data["formatted_sections"] = [formatted_content.model_dump()
+                                      for formatted_content in data["formatted_sections"]]
+    if "new_cards" in data:
+        data["new_cards"] = data["new_cards"].model_dump()
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+def load_run(path):
+    with open(path, encoding="utf-8") as f:
+        run = json.load(f)
+    run["job"] = Job(**run["job"])
+    if "changed_sections" in run:
+        run["changed_sections"] = [(section_id, [(block, depth) for block, depth in blocks])
+                                   for section_id, blocks in run["changed_sections"]]
+    if "formatted_sections" in run:
+        run["formatted_sections"] = [Anki.model_validate(formatted_content)
+                                     for formatted_content in run["formatted_sections"]]
+    if "new_cards" in run:
+        run["new_cards"] = Anki.model_validate(run["new_cards"])
+    return run
+
+def notion_to_notion(page_id_source, page_id_destine, language, full_sync=False, use_llm_cache=True, llm_mode="sync",
+                     create_temp_page=True):
+
+    # IMPORTANT: This code only support certain block types
+    # Only the sections (split by top level headings) that changed since the last sync are sent to
+    # the LLM and only their cards are appended.
+    # Returns the url of the TempPage (None if not created) and the new cards, or None when there are no new cards.
+    # Errors are raised, the sections of a failed run are handled again by the next one.
+    # The sections count as synced once their cards are in Notion: to import them in Anki too use
+    # sync_jobs, which checkpoints the run so a failed import can be resumed.
+
+    job = Job(source=page_id_source, destination=page_id_destine, language=language,
+              export_mode="2anki" if create_temp_page else "direct")
+    run = fetch_changes(job, full_sync)
+    try:
+        run = process_changes(run)
+    finally:
+        shutdown_image_pool()
+    run = format_changes(run, use_llm_cache, llm_mode)
+    run = publish_changes(run)
+    print("Done")
+    if not run["new_cards"].anki:
+        return None
+    return run["temp_page_url"], run["new_cards"]
+
+def export_deck(temp_page_url, formatted_content, deck_name_destiny, export_mode):
+    # Returns the path of the Notion page zip and of the Anki deck file, None when the mode has none
+    if export_mode == "native":
+        # 2. Write the Anki deck file from the cards
+        return None, export_apkg(formatted_content, deck_name_destiny)
+    if export_mode == "2anki":
+        # 2. Convert the notes from Notion to html and then to Anki format using 2Anki
+        return notion_to_2anki(temp_page_url)
+    return None, None
+
+def import_deck(notion_deck_path, formatted_content, deck_name_destiny, export_mode):
+    if export_mode == "direct":
+        # 2-3. Add the cards straight to the destination deck
+        anki_to_anki_connect(formatted_content, deck_name_destiny)
+    elif export_mode == "native":
+        # 3. Import the Anki deck file using Anki Connect as API
+        import_anki_package(notion_deck_path)
+    else:
+        # 3. Import the Anki deck file using Anki Connect as API
+        two_anki_to_anki_connect(notion_deck_path, deck_name_destiny)
+
+def import_to_anki(temp_page_url, formatted_content, deck_name_destiny, export_mode):
+    notion_page_zip_path, notion_deck_path = export_deck(temp_page_url, formatted_content, deck_name_destiny,
+                                                         export_mode)
+    import_deck(notion_deck_path, formatted_content, deck_name_destiny, export_mode)
+
+    # 4. Delete the remanent files
+    clean_files(temp_page_url, notion_deck_path, notion_page_zip_path)
+
+def load_jobs(path):
+    """
+    Read a job file, JSON or YAML (with PyYAML installed):
+        {"defaults": {"language": "es", "export_mode": "direct"},
+         "jobs": [{"source": "...", "destination": "...", "deck": "..."}]}
+    A plain list of jobs is accepted too.
+    """
+    with open(path, encoding="utf-8") as f:
+        if path.endswith((".yaml", ".yml")):
+            import yaml
+            data = yaml.safe_load(f)
+        else:
+            data = json.load(f)
+    if isinstance(data, list):
+        data = {"jobs": data}
+    defaults = data.get("defaults", {})
+    return check_jobs([Job(**{**defaults, **job}) for job in data["jobs"]])
+
+def check_jobs(jobs):
+    # Every export mode ends importing the cards in the deck of the job, a job without one would only
+    # fail after its cards were generated and appended to Notion
+    for number, job in enumerate(jobs):
+        if not job.deck:
+            raise ValueError(f"Job {number} ({job.source}) has no deck, the {job.export_mode} export needs one")
+    return jobs
+
+class RunJournal:
+    """
+    Checkpoints of a run of the pipeline in RUNS_DIR/<run id>/: the run dict of every job, saved
+    atomically after each stage it finishes. Resuming the run skips the stages already done, so a
+    failed import doesn't send the notes to the LLM or append the cards to Notion again.
+    """
+
+    def __init__(self, run_id, directory=RUNS_DIR):
+        self.run_id = run_id
+        self.directory = os.path.join(directory, run_id)
+
+    def save(self, run):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        save_run(run, os.path.join(self.directory, f"{run['key']}.json"))
+
+    def load(self):
+        if not os.path.isdir(self.directory):
+            raise FileNotFoundError(f"No checkpoints of the run {self.run_id} in {self.directory}")
+        return [load_run(os.path.join(self.directory, name))
+                for name in sorted(os.listdir(self.directory)) if name.endswith(".json")]
+
+def checkpointed(journal, name, func):
+    # The stage is skipped for the jobs that already finished it, the others are saved after it
+    def stage(run):
+        if name in run["stages_done"]:
+            return run
+        run = func(run)
+        run["stages_done"].append(name)
+        journal.save(run)
+        return run
+    return stage
+
+def run_jobs(path, full_sync=False, use_llm_cache=True, llm_mode="sync", stage_workers=None):
+    # Sync every job of a job file, see sync_jobs
+    return sync_jobs(load_jobs(path), full_sync, use_llm_cache, llm_mode, stage_workers)
+
+def sync_jobs(jobs, full_sync=False, use_llm_cache=True, llm_mode="sync", stage_workers=None):
+    """
+    Sync the jobs through a staged pipeline: fetch -> images -> format -> publish -> export -> import.
+    Every stage has its own workers, so one page can be formatted by the LLM while the images of
+    another one are uploaded. stage_workers overrides the workers of the stages by name.
+    Every job is checkpointed after each stage, a failed run continues with resume_jobs.
+    In batch and async modes every job is fetched and its images ingested first, then the chunks of
+    all of them go to the LLM together (a single Batch job, or one async client with one limit of
+    requests in flight) and the format stage only reads the responses.
+    """
+    check_jobs(jobs)
+    run_id = tracing.start_run(TRACES_DIR)
+    journal = RunJournal(run_id)
+    runs = [{"key": f"job-{number:03d}", "run_id": run_id, "job": job, "stages_done": []}
+            for number, job in enumerate(jobs)]
+    for run in runs:
+        journal.save(run)
+    return run_stages(runs, journal, full_sync, use_llm_cache, llm_mode, stage_workers)
+
+def resume_jobs(run_id, full_sync=False, use_llm_cache=True, llm_mode="sync", stage_workers=None):
+    # Continue a run of sync_jobs from its checkpoints, every job from the first stage it didn't finish
+    journal = RunJournal(run_id)
+    runs = journal.load()
+    tracing.start_run(TRACES_DIR, run_id)
+    for run in runs:
+        run["run_id"] = run_id
+        if "fetch" in run["stages_done"] and "images" not in run["stages_done"]:
+            # The urls of the files hosted by Notion are signed for about an hour, the ones in the
+            # checkpoint may have expired: the page is fetched again before ingesting its images
+            run["stages_done"].remove("fetch")
+        if run["stages_done"]:
+            print(f"Trabajo {run['job'].source}: etapas ya completadas {', '.join(run['stages_done'])}")
+    return run_stages(runs, journal, full_sync, use_llm_cache, llm_mode, stage_workers)
+
+def format_together(runs, use_llm_cache, llm_mode):
+    # The chunks of the runs that still have to be formatted, sent together, see sync_jobs
+    pending = [run for run in runs if "format" not in run["stages_done"]]
+    return format_jobs([(run["notes"], run["job"].language) for run in pending], use_llm_cache, llm_mode)
+
+def run_stages(runs, journal, full_sync, use_llm_cache, llm_mode, stage_workers):
+    workers = {**PIPELINE_WORKERS, **(stage_workers or {})}
+    prefetched = {}
+    stages = [
+        ("fetch", lambda run: {**run, **fetch_changes(run["job"], full_sync)}),
+        ("images", process_changes),
+        ("format", lambda run: format_changes(run, use_llm_cache, llm_mode, prefetched, journal.save)),
+        ("publish", publish_changes),
+        ("export", export_changes),
+        ("import", import_changes),
+    ]
+    stages = [Stage(name, checkpointed(journal, name, func), workers[name]) for name, func in stages]
+    if llm_mode in JOBS_MODES:
+        # A Batch per job would hold a format worker for up to 24 hours each, and an async client per
+        # job would only limit the requests in flight of its own page: the jobs are formatted together
+        ready, errors = run_pipeline(runs, stages[:2], PIPELINE_QUEUE_SIZE)
+        shutdown_image_pool()
+        try:
+            prefetched.update(format_together(ready, use_llm_cache, llm_mode))
+        except Exception as e:
+            print("Error formatting the jobs together:", e)
+            errors.extend((run, "format", e) for run in ready if "format" not in run["stages_done"])
+            ready = [run for run in ready if "format" in run["stages_done"]]
+        finished, later_errors = run_pipeline(ready, stages[2:], PIPELINE_QUEUE_SIZE)
+        errors.extend(later_errors)
+    else:
+        finished, errors = run_pipeline(runs, stages, PIPELINE_QUEUE_SIZE)
+        shutdown_image_pool()
+    print("Traza de la ejecución:", tracing.end_run())
+    print(f"Trabajos completados: {len(finished)} de {len(runs)}")
+    for run, stage, e in errors:
+        print(f"Error in job {run['job'].source} ({stage}):", e)
+    if errors:
+        print(f"Para reanudar desde la etapa que falló: python -m notion_to_anki run --resume {journal.run_id}")
+    return finished, errors
@@ -0,0 +1,112 @@
+import hashlib
+import json
+import sqlite3
+
+
+class SyncState:
+    """
+    What was already synced from a source page: every block with its last_edited_time and content hash,
+    and for every section of the page its fingerprint and the cards that were generated from it.
+    A sync is identified by the source page, the destination page and the language.
+    """
+
+    def __init__(self, db_path):
+        self.connection = sqlite3.connect(db_path)
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS blocks (
+                    sync_id TEXT NOT NULL,
+                    block_id TEXT NOT NULL,
+                    section_id TEXT NOT NULL,
+                    last_edited_time TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    PRIMARY KEY (sync_id, block_id)
+                )""")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS sections (
+                    sync_id TEXT NOT NULL,
+                    section_id TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    cards TEXT NOT NULL,
+                    PRIMARY KEY (sync_id, section_id)
+                )""")
+
+    def fingerprint(self, sync_id, section_id):
+        row = self.connection.execute(
+            "SELECT fingerprint FROM sections WHERE sync_id = ? AND section_id = ?", (sync_id, section_id)
+        ).fetchone()
+        return row[0] if row else None
+
+    def cards(self, sync_id, section_id):
+        row = self.connection.execute(
+            "SELECT cards FROM sections WHERE sync_id = ? AND section_id = ?", (sync_id, section_id)
+        ).fetchone()
+        return json.loads(row[0]) if row else []
+
+    def card_images(self):
+        # Urls of the images of every card remembered, of every sync
+        urls = set()
+        for (cards,) in self.connection.execute("SELECT cards FROM sections"):
+            urls.update(card["image"] for card in json.loads(cards) if card.get("image"))
+        return urls
+
+    def save_section(self, sync_id, section_id, blocks, cards):
+        # cards is a list of dicts, blocks the (block, depth) pairs of the section
+        with self.connection:
+            self.connection.execute("DELETE FROM blocks WHERE sync_id = ? AND section_id = ?", (sync_id, section_id))
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO blocks (sync_id, block_id, section_id, last_edited_time, content_hash) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(sync_id, block["id"], section_id, block["last_edited_time"], block_content_hash(block))
+                 for block, depth in blocks]
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO sections (sync_id, section_id, fingerprint, cards) VALUES (?, ?, ?, ?)",
+                (sync_id, section_id, section_fingerprint(blocks), json.dumps(cards))
+            )
+
+    def prune(self, sync_id, section_ids):
+        # Forget the sections that are no longer in the page
+        with self.connection:
+            for table in ("blocks", "sections"):
+                known = [row[0] for row in self.connection.execute(
+                    f"SELECT DISTINCT section_id FROM {table} WHERE sync_id = ?", (sync_id,)
+                )]
+                self.connection.executemany(
+                    f"DELETE FROM {table} WHERE sync_id = ? AND section_id = ?",
+                    [(sync_id, section_id) for section_id in known if section_id not in section_ids]
+                )
+
+    def close(self):
+        self.connection.close()
+
+
+def block_content_hash(block):
+    # Hash of what the block says, not of when it was edited. The signed urls of the
+    # Notion hosted files change on every request, so only their path is hashed.
+    content = dict(block.get(block["type"], {}))
+    if isinstance(content.get("file"), dict):
+        content["file"] = content["file"]["url"].split("?")[0]
+    data = json.dumps([block["type"], block.get("has_children", False), content], sort_keys=True)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def section_fingerprint(blocks):
+    # A section changes when any of its blocks is added, removed, moved or changes its content
+    sha256 = hashlib.sha256()
+    for block, depth in blocks:
+        sha256.update(f"{block['id']}:{depth}:{block_content_hash(block)}\n".encode("utf-8"))
+    return sha256.hexdigest()
+
+
+def iter_sections(blocks, section_types=("heading_1", "heading_2")):
+    # Group the (block, depth) stream in sections, a new one starts at every top level heading.
+    # A section is identified by the id of its first block.
+    section = []
+    for block, depth in blocks:
+        if section and depth == 0 and block["type"] in section_types:
+            yield section[0][0]["id"], section
+            section = []
+        section.append((block, depth))
+    if section:
+        yield section[0][0]["id"], section
@@ -0,0 +1,162 @@
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent import futures
+from contextlib import contextmanager
+
+
+class Tracer:
+    """
+    Records a span per stage with its wall time and counters (bytes, blocks, images, tokens, cards,
+    retries, HTTP status codes...) and writes them as JSON lines, one file per run.
+    A counter goes to the innermost open span of the thread and always to the totals of the run.
+    The tasks of a TracedExecutor count to the span that was open when they were submitted.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.run_id = None
+        self.path = None
+        self.started = None
+        self.totals = Counter()
+
+    def start_run(self, directory, run_id=None):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        with self.lock:
+            self.run_id = run_id or time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+            self.path = os.path.join(directory, f"{self.run_id}.jsonl")
+            self.started = time.time()
+            self.totals = Counter()
+        return self.run_id
+
+    def end_run(self):
+        # Writes the totals of the run, returns the path of the trace
+        if self.path is None:
+            return None
+        self.write({
+            "type": "run", "run_id": self.run_id, "start": self.started,
+            "duration": time.time() - self.started, "counters": dict(self.totals)
+        })
+        path = self.path
+        self.path = None
+        return path
+
+    def stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def count(self, name, value=1):
+        stack = self.stack()
+        # Several threads can count to the same span
+        with self.lock:
+            if stack:
+                stack[-1]["counters"][name] += value
+            self.totals[name] += value
+
+    def in_span(self, func):
+        # func, run in another thread, counts to the current span of this thread and the spans it
+        # opens are children of it
+        stack = self.stack()
+        if not stack:
+            return func
+        parent = stack[-1]
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            worker_stack = self.stack()
+            worker_stack.append(parent)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                worker_stack.remove(parent)
+        return wrapper
+
+    @contextmanager
+    def span(self, name, **attributes):
+        stack = self.stack()
+        span = {
+            "type": "span", "run_id": self.run_id, "id": uuid.uuid4().hex[:12],
+            "parent": stack[-1]["id"] if stack else None, "name": name, "thread": threading.current_thread().name,
+            "thread_id": threading.get_ident(),
+            "start": time.time(), "attributes": attributes, "counters": Counter(), "error": None
+        }
+        stack.append(span)
+        started = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span["error"] = repr(e)
+            raise
+        finally:
+            span["duration"] = time.perf_counter() - started
+            # Removed by identity, a generator span can be closed after spans opened later
+            if span in stack:
+                stack.remove(span)
+            self.write(span)
+            counters = ", ".join(f"{key}={value}" for key, value in sorted(span["counters"].items()))
+            print(f"[{name}] {span['duration']:.2f}s {counters}".rstrip())
+
+    def write(self, record):
+        if self.path is None:
+            return
+        line = json.dumps(record, default=str)
+        with self.lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+class TracedExecutor(futures.ThreadPoolExecutor):
+    """A thread pool whose tasks are counted in the span that submitted them, not lost to the run totals."""
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(tracer.in_span(fn), *args, **kwargs)
+
+
+tracer = Tracer()
+start_run = tracer.start_run
+end_run = tracer.end_run
+span = tracer.span
+count = tracer.count
+
+
+def traced(name):
+    # Decorator that wraps every call of a function (or the whole iteration of a generator) in a span
+    def decorator(func):
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                with span(name):
+                    yield from func(*args, **kwargs)
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def to_chrome_trace(trace_path, output_path):
+    # Convert a trace to the Chrome trace event format (chrome://tracing, Perfetto)
+    events = []
+    with open(trace_path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record["type"] != "span":
+                continue
+            events.append({
+                "name": record["name"], "ph": "X", "pid": 1, "tid": record["thread_id"],
+                "ts": record["start"] * 1e6, "dur": record["duration"] * 1e6,
+                "args": {**record["attributes"], **record["counters"], "error": record["error"]}
+            })
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events}, f)
@@ -0,0 +1,186 @@
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from .config import (WATCH_STATE_PATH, WATCH_POLL_INTERVAL, WATCH_MAX_POLL_INTERVAL, WATCH_DEBOUNCE,
+                     WATCH_RETRY_INTERVAL, WATCH_MAX_RETRY_INTERVAL)
+from .backends.notion import iter_edited_pages
+from .sync import load_jobs, sync_jobs, resume_jobs
+
+
+def normalize_page_id(page_id):
+    # Notion accepts ids with and without dashes, the search returns them with dashes
+    return page_id.replace("-", "").lower()
+
+
+def parse_time(timestamp):
+    return datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+
+
+class WatchState:
+    """
+    What the watch mode knows, saved atomically after every poll so a restart misses no edit:
+    the cursor (newest last_edited_time seen), the edits waiting for their debounce, the
+    last_edited_time of every page when it was last synced and, for the pages whose sync failed,
+    the run to resume, the edit it was syncing, the failed attempts and when to retry.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.cursor = None
+        self.pending = {}
+        self.synced = {}
+        self.failed = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.cursor = data.get("cursor")
+            self.pending = data.get("pending", {})
+            self.synced = data.get("synced", {})
+            self.failed = data.get("failed", {})
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"cursor": self.cursor, "pending": self.pending, "synced": self.synced,
+                       "failed": self.failed}, f)
+        os.replace(temp_path, self.path)
+
+
+def poll(state, sources):
+    """
+    Ask Notion for the pages edited since the cursor and queue the ones that are a job source and
+    changed since their last sync. Returns the number of pages queued.
+    """
+    queued = 0
+    for page in iter_edited_pages(state.cursor):
+        edited = page["last_edited_time"]
+        if state.cursor is None or edited > state.cursor:
+            state.cursor = edited
+        page_id = normalize_page_id(page["id"])
+        if page_id not in sources or edited <= state.synced.get(page_id, ""):
+            continue
+        if state.pending.get(page_id) != edited:
+            state.pending[page_id] = edited
+            queued += 1
+    return queued
+
+
+def due_time(state, page_id, debounce):
+    # When a pending page is synced: debounce seconds after its last edit, not before its retry if it failed
+    due = parse_time(state.pending[page_id]) + timedelta(seconds=debounce)
+    if page_id in state.failed and "next_retry" in state.failed[page_id]:
+        due = max(due, parse_time(state.failed[page_id]["next_retry"]))
+    return due
+
+
+def due_pages(state, debounce, now=None):
+    # The pages whose last edit is at least debounce seconds old, a burst of edits is synced once.
+    # A page that failed waits for its retry.
+    now = now or datetime.now(timezone.utc)
+    return [page_id for page_id in state.pending if due_time(state, page_id, debounce) <= now]
+
+
+def record_failure(state, page_id, run_id, now=None):
+    # The run to resume and when, the retries get further apart while the page keeps failing
+    now = now or datetime.now(timezone.utc)
+    previous = state.failed.get(page_id, {})
+    attempts = previous.get("attempts", 0) + 1
+    delay = min(WATCH_RETRY_INTERVAL * 2 ** (attempts - 1), WATCH_MAX_RETRY_INTERVAL)
+    state.failed[page_id] = {"run_id": run_id, "edited": previous.get("edited", state.pending[page_id]),
+                             "attempts": attempts, "next_retry": (now + timedelta(seconds=delay)).isoformat()}
+    print(f"Página {page_id}: sincronización fallida ({attempts}), se reintenta en {delay}s")
+
+
+def sync_due_pages(state, due, sources, use_llm_cache, llm_mode):
+    # Resume the failed runs of the due pages and sync the others, returns the errors of both
+    errors = []
+    fresh = [page_id for page_id in due if page_id not in state.failed]
+    for run_id in dict.fromkeys(state.failed[page_id]["run_id"] for page_id in due if page_id in state.failed):
+        try:
+            errors.extend(resume_jobs(run_id, use_llm_cache=use_llm_cache, llm_mode=llm_mode)[1])
+        except FileNotFoundError as e:
+            # The checkpoints were deleted (gc), the pages are synced again from scratch
+            print(e)
+            for page_id in due:
+                if state.failed.get(page_id, {}).get("run_id") == run_id:
+                    state.failed.pop(page_id)
+                    fresh.append(page_id)
+    if fresh:
+        errors.extend(sync_jobs([job for page_id in fresh for job in sources[page_id]],
+                                use_llm_cache=use_llm_cache, llm_mode=llm_mode)[1])
+    return errors
+
+
+def watch(jobs_path, poll_interval=WATCH_POLL_INTERVAL, max_poll_interval=WATCH_MAX_POLL_INTERVAL,
+          debounce=WATCH_DEBOUNCE, use_llm_cache=True, llm_mode="sync", once=False, state_path=WATCH_STATE_PATH):
+    """
+    Keep the jobs of a job file in sync: poll Notion for edited pages and run the pipeline only for
+    the jobs whose source page changed, once the page has been quiet for debounce seconds.
+    While nothing changes the polls get further apart, up to max_poll_interval, so an idle watch
+    costs one small search request every few minutes. The first start syncs every job once.
+    A page whose sync failed is resumed with exponential backoff, see record_failure.
+    """
+    state = WatchState(state_path)
+    interval = poll_interval
+    while True:
+        # Read every time, jobs can be added without restarting the watch
+        jobs = load_jobs(jobs_path)
+        sources = {}
+        for job in jobs:
+            sources.setdefault(normalize_page_id(job.source), []).append(job)
+        if state.cursor is None:
+            now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+            state.pending.update({page_id: now for page_id in sources if page_id not in state.synced})
+            debounce_now = 0
+        else:
+            debounce_now = debounce
+
+        try:
+            queued = poll(state, sources)
+        except Exception as e:
+            print("Error polling Notion:", e)
+            queued = 0
+        if queued:
+            print(f"Páginas editadas: {queued}, esperando {debounce}s sin cambios antes de sincronizar")
+
+        due = [page_id for page_id in due_pages(state, debounce_now) if page_id in sources]
+        if due:
+            errors = sync_due_pages(state, due, sources, use_llm_cache, llm_mode)
+            failed = {normalize_page_id(run["job"].source): run["run_id"] for run, stage, e in errors}
+            for page_id in due:
+                if page_id in failed:
+                    # The run is resumed once its retry is due, a fresh sync would find the sections
+                    # of a failed import already saved as synced and never import their cards
+                    record_failure(state, page_id, failed[page_id])
+                    continue
+                previous = state.failed.pop(page_id, None)
+                if previous is not None and previous["edited"] != state.pending[page_id]:
+                    # The resumed run synced the edit that failed, the newer one is synced next
+                    state.synced[page_id] = previous["edited"]
+                    continue
+                state.synced[page_id] = state.pending.pop(page_id)
+        # Pages that are not a source anymore are forgotten
+        for page_id in list(state.pending):
+            if page_id not in sources:
+                state.pending.pop(page_id)
+                state.failed.pop(page_id, None)
+        state.save()
+
+        if once:
+            return state
+        # The pages waiting for a retry don't keep the polls frequent
+        if queued or due or any(page_id not in state.failed for page_id in state.pending):
+            interval = poll_interval
+        else:
+            interval = min(interval * 2, max_poll_interval)
+        if state.pending:
+            # Wake up when the next pending page is due, not a full interval later
+            now = datetime.now(timezone.utc)
+            wait = min((due_time(state, page_id, debounce) - now).total_seconds() for page_id in state.pending)
+            interval = max(1, min(interval, wait))
+        time.sleep(interval)
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from bench import import_sync, point_to_fakes
+from fake_services import FakeServices
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # The state, traces and exports folders are relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def services(workdir):
+    # Every backend talks to the fake services, with dummy credentials when there are none
+    import_sync()
+    with FakeServices({}) as services:
+        point_to_fakes(services, 1000)
+        yield services
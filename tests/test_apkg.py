@@ -0,0 +1,52 @@
+import json
+import sqlite3
+import zipfile
+
+from notion_to_anki.apkg import write_apkg
+from notion_to_anki.models import Card
+
+
+def read_package(path, tmp_path):
+    with zipfile.ZipFile(path) as package:
+        package.extract("collection.anki2", tmp_path)
+        media = json.loads(package.read("media"))
+        files = {name: package.read(name) for name in media}
+    connection = sqlite3.connect(tmp_path / "collection.anki2")
+    try:
+        notes = connection.execute("SELECT id, flds, sfld FROM notes ORDER BY id").fetchall()
+        cards = connection.execute("SELECT nid, did FROM cards ORDER BY nid").fetchall()
+        decks = json.loads(connection.execute("SELECT decks FROM col").fetchone()[0])
+    finally:
+        connection.close()
+    return notes, cards, decks, media, files
+
+
+def test_notes_cards_and_deck(tmp_path):
+    cards = [Card(question="Is 1 < 2?", answer="Yes\nalways", image=None),
+             Card(question="Second", answer="With an <image>", image='http://x/"quoted".png')]
+    path = tmp_path / "deck.apkg"
+    assert write_apkg(str(path), "My deck", cards) == 2
+
+    notes, card_rows, decks, media, files = read_package(path, tmp_path)
+    assert [sfld for _, _, sfld in notes] == ["Is 1 < 2?", "Second"]
+    front, back = notes[0][1].split("\x1f")
+    assert front == "Is 1 &lt; 2?"
+    assert back == "Yes<br>always"
+    # An image that is not embedded keeps its url, escaped
+    assert 'src="http://x/&quot;quoted&quot;.png"' in notes[1][1]
+    deck_id = next(int(did) for did, deck in decks.items() if deck["name"] == "My deck")
+    assert [(nid, did) for nid, did in card_rows] == [(notes[0][0], deck_id), (notes[1][0], deck_id)]
+    assert media == {} and files == {}
+
+
+def test_images_embedded_once(tmp_path):
+    image = tmp_path / "abc.png"
+    image.write_bytes(b"png bytes")
+    cards = [Card(question=f"Q{i}", answer="A", image="http://cdn/abc.png") for i in range(3)]
+    path = tmp_path / "deck.apkg"
+    write_apkg(str(path), "Deck", cards, lambda url: str(image))
+
+    notes, _, _, media, files = read_package(path, tmp_path)
+    assert media == {"0": "abc.png"}
+    assert files == {"0": b"png bytes"}
+    assert all('<img src="abc.png">' in flds for _, flds, _ in notes)
@@ -0,0 +1,44 @@
+import json
+
+from notion_to_anki.block_writer import (MAX_BLOCKS_PER_REQUEST, MAX_CHILDREN_PER_REQUEST, MAX_PAYLOAD_BYTES,
+                                         MAX_TEXT_LENGTH, count_blocks, rich_text, split_batches)
+
+
+def paragraph(text, children=None):
+    block = {"object": "block", "type": "paragraph", "paragraph": {"rich_text": rich_text(text)}}
+    if children:
+        block["paragraph"]["children"] = children
+    return block
+
+
+def test_rich_text_splits_long_text():
+    text = "x" * (MAX_TEXT_LENGTH * 2 + 5)
+    pieces = rich_text(text)
+    assert [len(piece["text"]["content"]) for piece in pieces] == [MAX_TEXT_LENGTH, MAX_TEXT_LENGTH, 5]
+    assert "".join(piece["text"]["content"] for piece in pieces) == text
+
+
+def test_rich_text_of_empty_text():
+    assert rich_text("") == [{"type": "text", "text": {"content": "", "link": None}}]
+
+
+def test_split_batches_by_children():
+    batches = split_batches([paragraph(str(i)) for i in range(MAX_CHILDREN_PER_REQUEST * 2 + 1)])
+    assert [len(batch) for batch in batches] == [MAX_CHILDREN_PER_REQUEST, MAX_CHILDREN_PER_REQUEST, 1]
+
+
+def test_split_batches_by_nested_blocks():
+    # A toggle with 299 children counts as 300 blocks, only 3 fit in a request
+    blocks = [paragraph("card", [paragraph("line") for _ in range(299)]) for _ in range(4)]
+    assert count_blocks(blocks[0]) == 300
+    batches = split_batches(blocks)
+    assert [len(batch) for batch in batches] == [3, 1]
+    assert all(sum(count_blocks(block) for block in batch) <= MAX_BLOCKS_PER_REQUEST for batch in batches)
+
+
+def test_split_batches_by_payload():
+    blocks = [paragraph("x" * MAX_TEXT_LENGTH * 20) for _ in range(20)]
+    batches = split_batches(blocks)
+    assert len(batches) > 1
+    assert all(len(json.dumps(batch).encode("utf-8")) <= MAX_PAYLOAD_BYTES for batch in batches)
+    assert [block for batch in batches for block in batch] == blocks
@@ -0,0 +1,46 @@
+import pytest
+
+from notion_to_anki.card_index import CardIndex, DuplicateFilter, card_entry, card_fingerprint, card_text
+
+
+ANSWER = ("The gradient of a function points in the direction of the steepest ascent and its norm is the "
+          "rate of change in that direction")
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = CardIndex(str(tmp_path / "cards.sqlite"))
+    yield index
+    index.close()
+
+
+def test_find_exact_and_near_duplicates(index):
+    index.add_many("Deck", [card_entry("What is the gradient?", ANSWER, note_id=1)])
+    fingerprint, signature, _ = card_entry("What is the gradient?", ANSWER)
+    assert index.find("Deck", fingerprint, signature) == fingerprint
+    # Same words with other formatting and a word changed
+    fingerprint, signature, _ = card_entry("<b>What is the gradient</b>", ANSWER.replace("steepest", "fastest"))
+    assert index.find("Deck", fingerprint, signature) == card_fingerprint(card_text("What is the gradient?", ANSWER))
+    assert index.note_ids("Deck") == {1}
+
+
+def test_find_is_per_deck_and_ignores_other_cards(index):
+    index.add_many("Deck", [card_entry("What is the gradient?", ANSWER)])
+    fingerprint, signature, _ = card_entry("What is the gradient?", ANSWER)
+    assert index.find("Other deck", fingerprint, signature) is None
+    fingerprint, signature, _ = card_entry("What is a hash table?", "An array of buckets indexed by the hash of the key")
+    assert index.find("Deck", fingerprint, signature) is None
+
+
+def test_duplicate_filter(index):
+    index.add_many("Deck", [card_entry("What is the gradient?", ANSWER)])
+    duplicates = DuplicateFilter(index, "Deck")
+    assert not duplicates.keep("What is the gradient?", ANSWER)
+    assert duplicates.keep("What is a hash table?", "An array of buckets indexed by the hash of the key")
+    # The cards of the run are compared with each other too
+    assert not duplicates.keep("What is a hash table?", "An array of buckets indexed by the hash of the key!")
+    assert duplicates.keep("What is a stack?", "A last in, first out list")
+    assert duplicates.dropped == 2
+    # Nothing is written to the index until the cards are published
+    fingerprint, signature, _ = card_entry("What is a stack?", "A last in, first out list")
+    assert index.find("Deck", fingerprint, signature) is None
@@ -0,0 +1,32 @@
+import json
+
+from notion_to_anki.llm_async import ObjectStreamParser
+
+
+CARDS = {"anki": [
+    {"question": 'What does "{" open?', "answer": "A \\ backslash and a } brace", "image": None},
+    {"question": "Second", "answer": "Nested {\"json\": [1, 2]} in a string", "image": "http://x/y.png"},
+]}
+
+
+def test_objects_of_a_whole_document():
+    parser = ObjectStreamParser(depth=2)
+    assert parser.feed(json.dumps(CARDS)) == CARDS["anki"]
+
+
+def test_objects_of_a_document_split_anywhere():
+    document = json.dumps(CARDS)
+    for size in (1, 2, 3, 7, 16):
+        parser = ObjectStreamParser(depth=2)
+        objects = []
+        for start in range(0, len(document), size):
+            objects.extend(parser.feed(document[start:start + size]))
+        assert objects == CARDS["anki"], size
+
+
+def test_object_returned_as_soon_as_it_is_complete():
+    parser = ObjectStreamParser(depth=2)
+    document = json.dumps(CARDS)
+    end_of_first = document.index('"image": null}') + len('"image": null}')
+    assert parser.feed(document[:end_of_first]) == [CARDS["anki"][0]]
+    assert parser.feed(document[end_of_first:]) == [CARDS["anki"][1]]
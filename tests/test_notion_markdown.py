@@ -0,0 +1,46 @@
+from notion_to_anki.notion_markdown import iter_markdown, rich_text_to_markdown
+
+
+def text(content, **annotations):
+    return {"type": "text", "plain_text": content, "href": None, "annotations": annotations}
+
+
+def block(block_type, *segments, **content):
+    return {"id": f"{block_type}-{len(segments)}", "type": block_type,
+            block_type: {"rich_text": list(segments), **content}}
+
+
+def test_annotations_joined_and_spaces_outside():
+    assert rich_text_to_markdown([text("bold ", bold=True), text("text", bold=True), text(" end")]) == \
+        "**bold text** end"
+    assert rich_text_to_markdown([text(" code ", code=True, bold=True)]) == " `code` "
+
+
+def test_numbered_lists_restart_and_nest():
+    blocks = [
+        (block("numbered_list_item", text("one")), 0),
+        (block("numbered_list_item", text("nested")), 1),
+        (block("numbered_list_item", text("two")), 0),
+        (block("paragraph", text("break")), 0),
+        (block("numbered_list_item", text("again")), 0),
+    ]
+    assert list(iter_markdown(blocks)) == ["1. one", "  1. nested", "2. two", "break", "1. again"]
+
+
+def test_block_types():
+    blocks = [
+        (block("heading_1", text("Title")), 0),
+        (block("to_do", text("done"), checked=True), 0),
+        (block("code", text("a = 1\nb = 2"), language="python"), 0),
+        (block("paragraph", text("   ")), 0),
+        ({"id": "eq", "type": "equation", "equation": {"expression": "e^x"}}, 0),
+        ({"id": "div", "type": "divider", "divider": {}}, 0),
+    ]
+    assert list(iter_markdown(blocks)) == ["# Title", "- [x] done", "```python", "a = 1", "b = 2", "```", "$$e^x$$"]
+
+
+def test_images_rendered_or_skipped():
+    image = {"id": "img", "type": "image", "image": {"type": "external", "external": {"url": "u"}, "caption": []}}
+    blocks = [(block("paragraph", text("before")), 0), (image, 1)]
+    assert list(iter_markdown(blocks)) == ["before"]
+    assert list(iter_markdown(blocks, lambda block, indent: indent + block["id"])) == ["before", "  img"]
@@ -0,0 +1,38 @@
+from notion_to_anki.pipeline import Stage, run_pipeline
+
+
+def test_items_go_through_every_stage():
+    stages = [Stage("double", lambda item: item * 2, workers=3), Stage("add", lambda item: item + 1, workers=2)]
+    finished, errors = run_pipeline(range(20), stages, queue_size=1)
+    assert sorted(finished) == [item * 2 + 1 for item in range(20)]
+    assert errors == []
+
+
+def test_failed_item_stops_and_the_others_go_on():
+    reached = []
+
+    def check(item):
+        if item == 3:
+            raise ValueError("bad item")
+        if item == 5:
+            # A worker that dies would leave the queues full, the pipeline must not hang
+            raise SystemExit(2)
+        return item
+
+    def last(item):
+        reached.append(item)
+        return item
+
+    stages = [Stage("check", check, workers=2), Stage("last", last)]
+    finished, errors = run_pipeline(range(8), stages)
+    assert sorted(finished) == [0, 1, 2, 4, 6, 7]
+    assert sorted(reached) == [0, 1, 2, 4, 6, 7]
+    assert sorted((item, stage, type(e).__name__) for item, stage, e in errors) == \
+        [(3, "check", "ValueError"), (5, "check", "SystemExit")]
+
+
+def test_none_drops_the_item():
+    stages = [Stage("filter", lambda item: item if item % 2 else None), Stage("keep", lambda item: item)]
+    finished, errors = run_pipeline(range(6), stages)
+    assert sorted(finished) == [1, 3, 5]
+    assert errors == []
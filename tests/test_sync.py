@@ -0,0 +1,48 @@
+from fake_services import build_page
+from notion_to_anki.models import Job
+
+SOURCE = "11111111-1111-1111-1111-111111111111"
+DESTINATION = "22222222-2222-2222-2222-222222222222"
+
+
+def fail_once(services, call):
+    """Make the OpenAI call number call answer 400 the first time it is made."""
+    chat_completion = services.openai.chat_completion
+    calls = [0]
+
+    def failing(request, body, query):
+        calls[0] += 1
+        if calls[0] == call:
+            return 400, {"error": {"message": "bad request", "type": "invalid_request_error"}}
+        return chat_completion(request, body, query)
+
+    services.openai.chat_completion = failing
+
+
+def toggle_questions(services, block_id):
+    return [block["toggle"]["rich_text"][0]["text"]["content"]
+            for block in services.notion.children.get(block_id, []) if block.get("type") == "toggle"]
+
+
+def test_streamed_cards_published_once_after_resume(services):
+    from notion_to_anki import sync
+
+    services.notion.add_page(SOURCE, build_page(200, 0, services.files.url, seed=1))
+    services.notion.add_page(DESTINATION, {"page": []})
+    fail_once(services, 3)
+    job = Job(source=SOURCE, destination=DESTINATION, deck="Deck", export_mode="native")
+
+    finished, errors = sync.sync_jobs([job], full_sync=True, llm_mode="stream", stage_workers={"format": 1})
+    assert finished == []
+    [(run, stage, _)] = errors
+    assert stage == "format"
+    published = toggle_questions(services, DESTINATION)
+    assert published
+
+    finished, errors = sync.resume_jobs(run["run_id"], llm_mode="stream")
+    assert errors == []
+    assert len(finished) == 1
+    questions = toggle_questions(services, DESTINATION)
+    # The cards streamed before the error are not published again
+    assert questions[:len(published)] == published
+    assert len(questions) == len(set(questions))